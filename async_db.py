@@ -0,0 +1,98 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from storage import backend
+from metrics import timed
+from prediction_lock import ensure_kickoffs, check_open
+
+# The storage backends are synchronous, so every call runs on a small bounded pool
+# instead of blocking the discord event loop
+DB_WORKERS = int(os.getenv('DB_WORKERS', 8))
+executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='storage')
+
+# Event loop lag above this threshold (in seconds) gets reported
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', 0.005))
+LOOP_LAG_INTERVAL = 0.25
+loop_lag = {'last': 0.0, 'max': 0.0, 'over_threshold': 0}
+loop_monitor_task = None
+
+# Coalesced user changes (reminder toggles, registrations, names) are written this often
+USER_FLUSH_INTERVAL = int(os.getenv('USER_FLUSH_INTERVAL', 30))
+user_flush_task = None
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+def wrap(func):
+    func = timed('storage')(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_blocking(func, *args, **kwargs)
+    return wrapper
+
+store_prediction = wrap(backend.save_prediction)
+store_predictions = wrap(backend.save_predictions)
+get_leaderboard = wrap(backend.get_leaderboard)
+get_top_users = wrap(backend.get_top_users)
+get_leaderboard_state = wrap(backend.get_leaderboard_state)
+get_user_rank = wrap(backend.get_user_rank)
+get_display_names = wrap(backend.get_display_names)
+save_display_names = wrap(backend.save_display_names)
+get_predictions_match = wrap(backend.get_predictions_match)
+get_predictions_user_match = wrap(backend.get_predictions_user_match)
+get_predictions_user_matches = wrap(backend.get_predictions_user_matches)
+get_past_predictions = wrap(backend.get_past_predictions)
+get_users_without_predictions = wrap(backend.get_users_without_predictions)
+get_reminder_targets = wrap(backend.get_reminder_targets)
+get_reminder_ledger = wrap(backend.get_reminder_ledger)
+record_reminders = wrap(backend.record_reminders)
+enable_reminder = wrap(backend.enable_reminder)
+disable_reminder = wrap(backend.disable_reminder)
+check_reminder_messages = wrap(backend.check_reminder_messages)
+flush_user_writes = wrap(backend.flush_user_writes)
+restore_leaderboard = wrap(backend.restore_leaderboard)
+
+async def save_prediction(user_id, match_id, home_goals, away_goals):
+    # Saves after kickoff are refused here, and again by the backend right before the write
+    await ensure_kickoffs()
+    check_open([match_id])
+    await store_prediction(user_id, match_id, home_goals, away_goals)
+
+async def save_predictions(user_id, predictions):
+    await ensure_kickoffs()
+    check_open(list(predictions))
+    await store_predictions(user_id, predictions)
+
+async def monitor_loop_lag():
+    # A sleep that wakes up late means something blocked the event loop in between
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = loop.time() - start - LOOP_LAG_INTERVAL
+        loop_lag['last'] = lag
+        loop_lag['max'] = max(loop_lag['max'], lag)
+        if lag > LOOP_LAG_THRESHOLD:
+            loop_lag['over_threshold'] += 1
+            print(f"Event loop was blocked for {lag * 1000:.1f} ms")
+
+def start_loop_monitor():
+    global loop_monitor_task
+    if loop_monitor_task is None:
+        loop_monitor_task = asyncio.get_running_loop().create_task(monitor_loop_lag())
+
+async def flush_user_writes_periodically():
+    while True:
+        await asyncio.sleep(USER_FLUSH_INTERVAL)
+        try:
+            await flush_user_writes()
+        except Exception as e:
+            print(f"An error occurred while flushing user writes: {e}")
+
+def start_user_flush():
+    global user_flush_task
+    if user_flush_task is None:
+        user_flush_task = asyncio.get_running_loop().create_task(flush_user_writes_periodically())
@@ -0,0 +1,114 @@
+# Minimal stand-ins for the discord objects the command handlers touch.
+# Every call that would reach Discord's API is counted.
+
+import asyncio
+
+discord_stats = {'api_calls': 0}
+
+async def api_call(latency):
+    discord_stats['api_calls'] += 1
+    if latency:
+        await asyncio.sleep(latency)
+
+class FakeUser:
+    def __init__(self, user_id, latency=0.0):
+        self.id = int(user_id)
+        self.name = f"player{user_id}"
+        self.display_name = f"Player {user_id}"
+        self.mention = f"<@{user_id}>"
+        self.latency = latency
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        await api_call(self.latency)
+        self.sent.append(content)
+
+class FakeChannel:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        await api_call(self.latency)
+        self.sent.append(content)
+
+class FakeGuild:
+    def __init__(self, members):
+        self.members = members
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    async def query_members(self, user_ids=None, limit=5, **kwargs):
+        discord_stats['api_calls'] += 1
+        return [self.members[user_id] for user_id in user_ids if user_id in self.members]
+
+class FakeBot:
+    def __init__(self, user_ids, latency=0.0):
+        self.latency = latency
+        self.users = {int(user_id): FakeUser(user_id, latency) for user_id in user_ids}
+        self.guilds = [FakeGuild(self.users)]
+        self.channel = FakeChannel(latency)
+
+    def get_user(self, user_id):
+        return self.users.get(int(user_id))
+
+    async def fetch_user(self, user_id):
+        await api_call(self.latency)
+        return self.users.get(int(user_id)) or FakeUser(user_id, self.latency)
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+def check_length(content):
+    if content and len(content) > 2000:
+        raise ValueError("A message may contain at most 2000 characters")
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, content=None, **kwargs):
+        check_length(content)
+        await api_call(self.interaction.latency)
+        self.done = True
+        self.interaction.messages.append((content, kwargs))
+
+    async def edit_message(self, content=None, **kwargs):
+        await api_call(self.interaction.latency)
+        self.done = True
+        self.interaction.messages.append((content, kwargs))
+
+    async def defer(self, **kwargs):
+        await api_call(self.interaction.latency)
+        self.done = True
+
+    async def send_modal(self, modal):
+        await api_call(self.interaction.latency)
+        self.done = True
+        self.interaction.messages.append((None, {'modal': modal}))
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        check_length(content)
+        await api_call(self.interaction.latency)
+        self.interaction.messages.append((content, kwargs))
+
+class FakeInteraction:
+    def __init__(self, user, latency=0.0):
+        self.user = user
+        self.latency = latency
+        self.channel = FakeChannel(latency)
+        self.messages = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def delete_original_response(self):
+        await api_call(self.latency)
@@ -0,0 +1,172 @@
+# In-memory stand-in for the parts of the Firestore client that firestore_db uses.
+# Every round trip sleeps for the injected latency and is counted, together with the
+# number of documents read and written.
+
+import threading
+import time
+import uuid
+from firebase_admin import firestore
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field) if self._data is not None else None
+
+class FakeDocument:
+    def __init__(self, client, collection, doc_id):
+        self.client = client
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self):
+        self.client.round_trip(reads=1)
+        return FakeSnapshot(self, self.client.data[self.collection].get(self.id))
+
+    def set(self, data, merge=False):
+        self.client.round_trip(writes=1)
+        self.client.apply_write(self, 'set', data, merge)
+
+    def update(self, data):
+        self.client.round_trip(writes=1)
+        self.client.apply_write(self, 'update', data)
+
+    def delete(self):
+        self.client.round_trip(writes=1)
+        self.client.apply_write(self, 'delete', None)
+
+class FakeQuery:
+    def __init__(self, client, collection, filters=(), order=None, limit_to=None):
+        self.client = client
+        self.collection = collection
+        self.filters = list(filters)
+        self.order = order
+        self.limit_to = limit_to
+
+    def where(self, filter):
+        return FakeQuery(self.client, self.collection, self.filters + [filter], self.order, self.limit_to)
+
+    def order_by(self, field, direction='ASCENDING'):
+        return FakeQuery(self.client, self.collection, self.filters, (field, direction), self.limit_to)
+
+    def limit(self, count):
+        return FakeQuery(self.client, self.collection, self.filters, self.order, count)
+
+    def select(self, fields):
+        return self
+
+    def matches(self, data):
+        for field_filter in self.filters:
+            value = data.get(field_filter.field_path)
+            if field_filter.op_string == '==' and value != field_filter.value:
+                return False
+            if field_filter.op_string == 'in' and value not in field_filter.value:
+                return False
+        return True
+
+    def stream(self):
+        with self.client.lock:
+            documents = [(doc_id, dict(data)) for doc_id, data in self.client.data[self.collection].items() if self.matches(data)]
+        if self.order:
+            field, direction = self.order
+            documents.sort(key=lambda document: document[1].get(field, 0), reverse=direction == firestore.Query.DESCENDING)
+        if self.limit_to is not None:
+            documents = documents[:self.limit_to]
+        self.client.round_trip(reads=max(len(documents), 1))
+        return [FakeSnapshot(FakeDocument(self.client, self.collection, doc_id), data) for doc_id, data in documents]
+
+    def get(self):
+        return self.stream()
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id=None):
+        return FakeDocument(self.client, self.collection, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        document = self.document()
+        document.set(data)
+        return None, document
+
+class FakeBatch:
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def __len__(self):
+        return len(self.writes)
+
+    def set(self, reference, data, merge=False):
+        self.writes.append((reference, 'set', data, merge))
+
+    def update(self, reference, data):
+        self.writes.append((reference, 'update', data, False))
+
+    def delete(self, reference):
+        self.writes.append((reference, 'delete', None, False))
+
+    def commit(self):
+        if len(self.writes) > 500:
+            raise ValueError("A batch may contain at most 500 writes")
+        self.client.round_trip(writes=len(self.writes))
+        for reference, kind, data, merge in self.writes:
+            self.client.apply_write(reference, kind, data, merge)
+
+class FakeFirestore:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.data = {}
+        self.lock = threading.Lock()
+        self.stats = {'round_trips': 0, 'reads': 0, 'writes': 0}
+
+    def reset_stats(self):
+        self.stats = {'round_trips': 0, 'reads': 0, 'writes': 0}
+
+    def round_trip(self, reads=0, writes=0):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.stats['round_trips'] += 1
+            self.stats['reads'] += reads
+            self.stats['writes'] += writes
+
+    def collection(self, name):
+        self.data.setdefault(name, {})
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, references):
+        references = list(references)
+        self.round_trip(reads=max(len(references), 1))
+        with self.lock:
+            return [FakeSnapshot(reference, self.data[reference.collection].get(reference.id)) for reference in references]
+
+    def apply_write(self, reference, kind, data, merge=False):
+        with self.lock:
+            documents = self.data[reference.collection]
+            if kind == 'delete':
+                documents.pop(reference.id, None)
+                return
+            if kind == 'update' and reference.id not in documents:
+                raise KeyError(f"No document to update: {reference.collection}/{reference.id}")
+            current = dict(documents.get(reference.id, {})) if (merge or kind == 'update') else {}
+            for field, value in data.items():
+                if isinstance(value, firestore.Increment):
+                    current[field] = current.get(field, 0) + value.value
+                elif isinstance(value, firestore.ArrayUnion):
+                    current[field] = current.get(field, []) + [item for item in value.values if item not in current.get(field, [])]
+                else:
+                    current[field] = value
+            documents[reference.id] = current
+
+    def load(self, collection, documents):
+        # Seed documents without counting them as traffic
+        self.data.setdefault(collection, {}).update(documents)
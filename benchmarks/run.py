@@ -0,0 +1,178 @@
+# Benchmark and load test of the bot's hot paths against local stand-ins for Firestore,
+# football-data.org and Discord.
+#
+# Usage: python -m benchmarks.run [--scales 100 1000 10000 50000] [--backend firestore|sqlite]
+#                                 [--db-latency 0.02] [--discord-latency 0.05] [--sample 100]
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+parser = argparse.ArgumentParser(description="Benchmark the bot at synthetic scales.")
+parser.add_argument('--scales', type=int, nargs='+', default=[100, 1000, 10000])
+parser.add_argument('--backend', choices=['firestore', 'sqlite'], default='firestore')
+parser.add_argument('--matches', type=int, default=18, help="matches per matchday")
+parser.add_argument('--db-latency', type=float, default=0.02, help="seconds per Firestore round trip")
+parser.add_argument('--discord-latency', type=float, default=0.05, help="seconds per Discord API call")
+parser.add_argument('--sample', type=int, default=100, help="concurrent users per command scenario")
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+# The bot's modules read their configuration on import
+os.environ.setdefault('DISCORD_CHANNEL_ID', '1')
+os.environ['STORAGE_BACKEND'] = args.backend
+os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+
+import pytz
+import firestore_db
+import football_api
+import game_updates
+import reminders
+import storage
+import user_cache
+from benchmarks.fake_discord import FakeBot, FakeInteraction, discord_stats
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.feed import build_season, install_feed, feed_stats
+from commands import register_leaderboard_command
+from fixtures import Match
+from history_commands import register_history_command
+from predict_commands import register_predict_command
+from rate_limit import TokenBucket
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def build_data(scale, finished, upcoming, rng):
+    users = [{'user_id': str(100000 + i), 'points': 0, 'reminders': rng.random() < 0.9} for i in range(scale)]
+    predictions = []
+    for user in users:
+        for match, chance in [(match, 0.8) for match in finished] + [(match, 0.5) for match in upcoming]:
+            if rng.random() < chance:
+                predictions.append({
+                    'prediction_id': f"{match['id']}_{user['user_id']}",
+                    'user_id': user['user_id'],
+                    'match_id': str(match['id']),
+                    'home_goals': rng.randint(0, 3),
+                    'away_goals': rng.randint(0, 3),
+                    'points': 1,
+                    'settled': False
+                })
+    return {'users': users, 'predictions': predictions, 'games': [], 'reminder_ledger': []}
+
+def reset_state(fake_db):
+    firestore_db.db = fake_db
+    firestore_db.leaderboard_cache = None
+    firestore_db.history_cache.clear()
+    firestore_db.prediction_cache.clear()
+    firestore_db.user_registry.clear()
+    firestore_db.pending_user_writes.clear()
+    football_api.feed_cache.clear()
+    game_updates.settled_matches = None
+    user_cache.name_cache.clear()
+
+async def sample_loop(stop, lags):
+    # Anything that keeps the loop busy shows up as a late wakeup
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(0.001)
+        lags.append(max(loop.time() - start - 0.001, 0.0))
+
+async def measure(name, calls, fake_db):
+    if fake_db:
+        fake_db.reset_stats()
+    discord_stats['api_calls'] = 0
+    feed_stats['requests'] = 0
+    stop = asyncio.Event()
+    lags = []
+    sampler = asyncio.ensure_future(sample_loop(stop, lags))
+
+    latencies = []
+
+    async def timed(call):
+        start = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(call) for call in calls))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await sampler
+
+    db_stats = fake_db.stats if fake_db else {'round_trips': '-', 'reads': '-', 'writes': '-'}
+    return {
+        'scenario': name,
+        'calls': len(calls),
+        'wall_s': elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'round_trips': db_stats['round_trips'],
+        'reads': db_stats['reads'],
+        'writes': db_stats['writes'],
+        'discord_calls': discord_stats['api_calls'],
+        'feed_requests': feed_stats['requests'],
+        'max_block_ms': max(lags, default=0.0) * 1000,
+        'blocked_ms': sum(lag for lag in lags if lag > 0.002) * 1000
+    }
+
+async def run_history(interaction, bot):
+    await register_history_command(interaction, bot)
+    # Pick the "This season" preset from the dropdown
+    view = next((kwargs['view'] for _, kwargs in reversed(interaction.messages) if kwargs.get('view')), None)
+    if view is None:
+        return
+    await view.show_preset(interaction, 'season')
+
+async def run_scale(scale, rng):
+    now = datetime.utcnow().replace(tzinfo=pytz.utc)
+    finished, upcoming = build_season(now, args.matches)
+    install_feed(finished + upcoming)
+
+    fake_db = FakeFirestore() if args.backend == 'firestore' else None
+    reset_state(fake_db)
+    if args.backend == 'sqlite':
+        storage.init_storage()
+    data = build_data(scale, finished, upcoming, rng)
+    storage.backend.import_data(data)
+    if fake_db:
+        fake_db.latency = args.db_latency
+
+    user_ids = [user['user_id'] for user in data['users']]
+    bot = FakeBot(user_ids, args.discord_latency)
+    sample = rng.sample(user_ids, min(args.sample, len(user_ids)))
+
+    def interactions():
+        return [FakeInteraction(bot.users[int(user_id)], args.discord_latency) for user_id in sample]
+
+    results = [await measure('settlement', [lambda: game_updates.check_game_updates(bot)], fake_db)]
+    results.append(await measure('/predict', [lambda i=i: register_predict_command(i, bot) for i in interactions()], fake_db))
+    results.append(await measure('/history', [lambda i=i: run_history(i, bot) for i in interactions()], fake_db))
+    results.append(await measure('/leaderboard', [lambda i=i: register_leaderboard_command(i, bot) for i in interactions()], fake_db))
+    results.append(await measure('reminders', [lambda: reminders.send_prediction_reminders(bot, [Match(match) for match in upcoming])], fake_db))
+    return len(data['predictions']), results
+
+async def main():
+    # Reminder DMs are normally paced to stay within Discord's limits; measure the work, not the pacing
+    reminders.dm_rate_limiter = TokenBucket(10 ** 9, 1)
+    rng = random.Random(args.seed)
+
+    columns = ['scenario', 'calls', 'wall_s', 'p50_ms', 'p95_ms', 'p99_ms', 'round_trips', 'reads', 'writes',
+               'discord_calls', 'feed_requests', 'max_block_ms', 'blocked_ms']
+    print(f"backend={args.backend} db_latency={args.db_latency}s discord_latency={args.discord_latency}s "
+          f"matches/matchday={args.matches} sample={args.sample}")
+    for scale in args.scales:
+        prediction_count, results = await run_scale(scale, rng)
+        print(f"\n{scale} users, {prediction_count} predictions")
+        print(''.join(f"{column:>14}" for column in columns))
+        for result in results:
+            print(''.join(f"{result[column]:>14.1f}" if isinstance(result[column], float) else f"{result[column]:>14}" for column in columns))
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -2,31 +2,42 @@ import asyncio
 import discord
 from discord.ext import commands
 from discord.ui import View, Button, Select
-from firestore_db import (
+from async_db import (
     save_prediction,
-    get_leaderboard,
+    get_top_users,
+    get_user_rank,
     get_predictions_user_match,
     get_past_predictions
 )
 from football_api import convert_to_belgian_time
+from user_cache import resolve_display_names
 from datetime import datetime
 
+# Number of players shown in a leaderboard message
+LEADERBOARD_SIZE = 25
+
+async def format_leaderboard(bot, sorted_leaderboard):
+    # Resolve all display names at once instead of one fetch_user per row
+    names = await resolve_display_names(bot, [user_id for user_id, _ in sorted_leaderboard])
+    leaderboard_message = "Updated Leaderboard:\n"
+
+    for i, (user_id, points) in enumerate(sorted_leaderboard):
+        display_name = names.get(user_id, 'unknown user')
+        if i < 3:
+            # Format top 3 users with special symbols
+            symbols = ["🥇", "🥈", "🥉"]
+            leaderboard_message += f"{symbols[i]} {display_name}: {points}pts\n"
+        else:
+            # Format for 4th place and beyond
+            leaderboard_message += f"{i + 1}) {display_name}: {points}pts\n"
+    return leaderboard_message
 
 def register_commands(bot):
 
     @bot.command(name='leaderboard')
     async def leaderboard(ctx):
-        leaderboard_data = get_leaderboard()
-        sorted_leaderboard = sorted(leaderboard_data.items(), key=lambda x: x[1], reverse=True)
-        leaderboard_message = "Updated Leaderboard:\n"
-        
-        for i, (user_id, points) in enumerate(sorted_leaderboard):
-            user = await bot.fetch_user(user_id)
-            if i < 3:
-                symbols = ["🥇", "🥈", "🥉"]
-                leaderboard_message += f"{symbols[i]} {user.display_name}: {points}pts\n"
-            else:
-                leaderboard_message += f"{i + 1}) {user.display_name}: {points}pts\n"
+        sorted_leaderboard = await get_top_users(LEADERBOARD_SIZE)
+        leaderboard_message = await format_leaderboard(bot, sorted_leaderboard)
         await ctx.send(leaderboard_message)
 
     @bot.command(name='uclhelp')
@@ -40,17 +51,14 @@ def register_commands(bot):
         await ctx.send(response)
 
 async def register_leaderboard_command(ctx, bot):
-    leaderboard_data = get_leaderboard()
-    sorted_leaderboard = sorted(leaderboard_data.items(), key=lambda x: x[1], reverse=True)
-    leaderboard_message = "Updated Leaderboard:\n"
-    
-    for i, (user_id, points) in enumerate(sorted_leaderboard):
-        user = await bot.fetch_user(user_id)
-        if i < 3:
-            symbols = ["🥇", "🥈", "🥉"]
-            leaderboard_message += f"{symbols[i]} {user.display_name}: {points}pts\n"
-        else:
-            leaderboard_message += f"{i + 1}) {user.display_name}: {points}pts\n"
+    sorted_leaderboard = await get_top_users(LEADERBOARD_SIZE)
+    leaderboard_message = await format_leaderboard(bot, sorted_leaderboard)
+
+    # Show the caller's own position when they are not in the top
+    user_id = str(ctx.user.id)
+    user_rank = await get_user_rank(user_id)
+    if user_rank and user_rank[0] > LEADERBOARD_SIZE:
+        leaderboard_message += f"...\n{user_rank[0]}) {ctx.user.display_name}: {user_rank[1]}pts\n"
     await ctx.response.send_message(leaderboard_message)
 
 async def register_uclhelp_command(ctx, bot):
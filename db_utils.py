@@ -0,0 +1,86 @@
+# Helpers shared by the storage backends
+import time
+from collections import defaultdict
+from datetime import datetime
+import pytz  # Importing pytz for timezone conversion
+
+def prediction_doc_id(match_id, user_id):
+    # Predictions are keyed by match and user, so a user can never have two for the same match
+    return f"{match_id}_{user_id}"
+
+def collapse_predictions(predictions, finished_ids):
+    # Re-keys exported predictions (dicts with a 'prediction_id') to prediction_doc_id and keeps
+    # one per user and match, like migrate_predictions: a settled one first, then the one that
+    # already has the new ID. Returns (predictions, {user_id: points of duplicates settled twice})
+    groups = defaultdict(list)
+    for prediction in predictions:
+        groups[(prediction['match_id'], prediction['user_id'])].append(prediction)
+
+    collapsed = []
+    point_corrections = defaultdict(int)
+    for (match_id, user_id), group in groups.items():
+        target_id = prediction_doc_id(match_id, user_id)
+        is_settled = lambda prediction: bool(prediction.get('settled')) or match_id in finished_ids
+        kept = max(group, key=lambda prediction: (is_settled(prediction), prediction['prediction_id'] == target_id))
+        for prediction in group:
+            if prediction is not kept and is_settled(prediction):
+                point_corrections[user_id] -= prediction.get('points', 0)
+        collapsed.append(dict(kept, prediction_id=target_id))
+    return collapsed, dict(point_corrections)
+
+class PredictionLocked(Exception):
+    # Raised when a prediction is saved for a match that already kicked off
+    def __init__(self, match_ids):
+        super().__init__(f"Predictions are closed for match {', '.join(match_ids)}")
+        self.match_ids = match_ids
+
+# Kickoff of every match as a UNIX timestamp, pushed by the prediction lock; both storage
+# backends refuse saves after kickoff right before the write
+match_kickoffs = {}
+
+def set_kickoffs(kickoffs):
+    global match_kickoffs
+    match_kickoffs = dict(kickoffs)
+
+def check_kickoffs(match_ids):
+    # Unknown matches are open here but closed in prediction_lock.is_open: every save from
+    # Discord passes is_open first, this check only guards against the race with kickoff,
+    # and the backends may not have been handed any kickoffs at all (e.g. in scripts)
+    now = time.time()
+    locked = [match_id for match_id in match_ids if match_kickoffs.get(match_id, now + 1) <= now]
+    if locked:
+        raise PredictionLocked(locked)
+
+def group_past_predictions(history, begin_date, end_date):
+    # Group settled predictions by Belgian date and kickoff time, within the date range
+    # Parse the date strings into datetime objects
+    begin_date = datetime.strptime(begin_date, "%d/%m/%Y").date()
+    end_date = datetime.strptime(end_date, "%d/%m/%Y").date()
+
+    # Use a dictionary to group games by date and time
+    result = defaultdict(lambda: defaultdict(list))
+
+    # Define timezones
+    utc = pytz.UTC
+    belgian_tz = pytz.timezone('Europe/Brussels')
+
+    for game in sorted(history, key=lambda game: game['date']):
+        # Parse the full UTC date-time string
+        game_date_utc = datetime.strptime(game['date'], "%Y-%m-%dT%H:%M:%SZ")
+        game_date_utc = utc.localize(game_date_utc)  # Localize to UTC
+
+        # Convert to Belgian time
+        game_date_belgian = game_date_utc.astimezone(belgian_tz)
+
+        # Extract date and time separately
+        game_date = game_date_belgian.date()  # This is now a date object
+        game_time = game_date_belgian.strftime("%H:%M")
+
+        # Only consider games within the specified date range
+        if begin_date <= game_date <= end_date:
+            # Store the results grouped by date and time
+            result[game_date.strftime("%d/%m/%Y")][game_time].append({
+                key: value for key, value in game.items() if key != 'date'
+            })
+
+    return result
@@ -1,15 +1,47 @@
+import time
+import threading
+import uuid
+import zlib
 from collections import defaultdict
-from datetime import datetime
 import firebase_admin
 from firebase_admin import credentials, firestore
-import pytz  # Importing pytz for timezone conversion
 from google.cloud.firestore_v1.base_query import FieldFilter
+from db_utils import prediction_doc_id, group_past_predictions, set_kickoffs, check_kickoffs
+from metrics import record_firestore
 from dotenv import load_dotenv
 import os
 
 # Initialize Firestore
 db = None
 
+# Firestore limits a batched write to 500 operations and an 'in' filter to 30 values
+BATCH_LIMIT = 500
+IN_QUERY_LIMIT = 30
+
+# The reminded users of a match are spread over this many ledger documents, so one match
+# stays far below the 1 MiB document size and the 40k index entries of a single array
+REMINDER_LEDGER_SHARDS = 16
+
+# The materialized leaderboard is split over documents of this many entries
+LEADERBOARD_SHARD_SIZE = 5000
+# In-memory copy of the leaderboard: {'ranking': [(user_id, points), ...], 'ranks': {user_id: index},
+# 'generation': token of the stored leaderboard it matches}
+leaderboard_cache = None
+# Settled predictions per user, dropped for a user when one of their predictions is settled
+history_cache = {}
+# Short-lived per-user predictions for the /predict overview: user_id -> (expires_at, {match_id: prediction})
+PREDICTION_CACHE_TTL = 300
+prediction_cache = {}
+# In-memory registry of the user documents, loaded once at startup:
+# user_id -> {'ref': DocumentReference, 'points': int, 'reminders': bool, 'display_name': str or None}
+user_registry = {}
+# Coalesced writes waiting for the next flush: user_id -> {'create': bool, 'fields': dict, 'points': int}
+pending_user_writes = {}
+registry_lock = threading.RLock()
+# Held for a whole flush, so a second flush (e.g. before a settlement) waits until the
+# user documents taken off the queue by the first one are committed
+flush_lock = threading.Lock()
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -35,61 +67,283 @@ def init_firestore():
     cred = credentials.Certificate(cred_data)
     firebase_admin.initialize_app(cred)
     db = firestore.client()
+    load_user_registry()
+
+# Every Firestore round trip goes through these helpers so that reads and writes are
+# counted per storage operation
+def stream(query):
+    documents = list(query.stream())
+    # A query without results is still billed as one read
+    record_firestore('read', max(len(documents), 1))
+    return documents
+
+def get_document(ref):
+    record_firestore('read', 1)
+    return ref.get()
+
+def get_all(refs):
+    record_firestore('read', len(refs))
+    return db.get_all(refs)
+
+def commit(batch):
+    record_firestore('write', len(batch))
+    batch.commit()
+
+def load_user_registry():
+    registry = {}
+    for user_doc in stream(db.collection('users')):
+        user_data = user_doc.to_dict()
+        if 'user_id' in user_data and user_data['user_id'] not in registry:
+            registry[user_data['user_id']] = {
+                'ref': user_doc.reference,
+                'points': user_data.get('points', 0),
+                'reminders': user_data.get('reminders', False),
+                'display_name': user_data.get('display_name')
+            }
+    with registry_lock:
+        user_registry.clear()
+        user_registry.update(registry)
+
+def get_user_entry(user_id, reminders=True):
+    # Returns the registry entry of a user, registering new users with a write-behind create
+    with registry_lock:
+        entry = user_registry.get(user_id)
+        if entry is None:
+            entry = {'ref': db.collection('users').document(), 'points': 0, 'reminders': reminders, 'display_name': None}
+            user_registry[user_id] = entry
+            pending_user_writes[user_id] = {'create': True, 'fields': {}, 'points': 0}
+        return entry
+
+def queue_user_write(user_id, fields=None, points=0):
+    with registry_lock:
+        pending = pending_user_writes.setdefault(user_id, {'create': False, 'fields': {}, 'points': 0})
+        pending['fields'].update(fields or {})
+        pending['points'] += points
+
+def flush_user_writes():
+    with flush_lock:
+        write_pending_users()
+
+def write_pending_users():
+    # Write all coalesced user changes in batches, point changes as atomic Increments
+    with registry_lock:
+        writes = dict(pending_user_writes)
+        pending_user_writes.clear()
+        operations = []
+        for user_id, pending in writes.items():
+            entry = user_registry[user_id]
+            if pending['create']:
+                operations.append((user_id, 'set', {
+                    'user_id': user_id,
+                    'points': pending['points'],
+                    'reminders': entry['reminders'],
+                    **({'display_name': entry['display_name']} if entry['display_name'] else {})
+                }))
+            else:
+                fields = dict(pending['fields'])
+                if pending['points']:
+                    fields['points'] = firestore.Increment(pending['points'])
+                if fields:
+                    operations.append((user_id, 'update', fields))
+
+    for i in range(0, len(operations), BATCH_LIMIT):
+        chunk = operations[i:i + BATCH_LIMIT]
+        batch = db.batch()
+        for user_id, kind, fields in chunk:
+            if kind == 'set':
+                batch.set(user_registry[user_id]['ref'], fields)
+            else:
+                batch.update(user_registry[user_id]['ref'], fields)
+        try:
+            commit(batch)
+        except Exception:
+            # Put the unwritten changes back, newer changes queued in the meantime win
+            with registry_lock:
+                for user_id, _, _ in operations[i:]:
+                    failed = writes[user_id]
+                    pending = pending_user_writes.setdefault(user_id, {'create': False, 'fields': {}, 'points': 0})
+                    pending['create'] = pending['create'] or failed['create']
+                    pending['fields'] = dict(failed['fields'], **pending['fields'])
+                    pending['points'] += failed['points']
+            raise
 
 def save_prediction(user_id, match_id, home_goals, away_goals):
-    # Reference to the 'predictions' collection
-    predictions_ref = db.collection('predictions')
-    
-    # Query to find if there's already a prediction for this user and match
-    query = predictions_ref.where(filter=FieldFilter('user_id', '==', user_id)).where(filter=FieldFilter('match_id', '==', match_id)).limit(1).get()
-    # query = predictions_ref.where('user_id', '==', user_id).where('match_id', '==', match_id).limit(1).get()
-    
-    if query:
-        # Update the existing prediction
-        for doc in query:
-            doc_ref = doc.reference
-            doc_ref.update({
-                'home_goals': home_goals,
-                'away_goals': away_goals,
-                'points': 1  # You might want to adjust this based on your points logic
-            })
-    else:
-        # Add a new prediction
-        predictions_ref.add({
+    # A single blind write that creates or overwrites the user's prediction for this match
+    check_kickoffs([match_id])
+    prediction_ref = db.collection('predictions').document(prediction_doc_id(match_id, user_id))
+    record_firestore('write', 1)
+    prediction_ref.set({
+        'user_id': user_id,
+        'match_id': match_id,
+        'home_goals': home_goals,
+        'away_goals': away_goals,
+        'points': 1  # You might want to adjust this based on your points logic
+    }, merge=True)
+
+    # Keep the cached overview of this user in line with what was just saved
+    if user_id in prediction_cache:
+        prediction_cache[user_id][1][match_id] = {
             'user_id': user_id,
             'match_id': match_id,
             'home_goals': home_goals,
             'away_goals': away_goals,
-            'points': 1  # You might want to adjust this based on your points logic
-        })
+            'points': 1
+        }
+
+def save_predictions(user_id, predictions):
+    # predictions is {match_id: (home_goals, away_goals)}, written in one batch
+    check_kickoffs(list(predictions))
+    predictions = list(predictions.items())
+    for i in range(0, len(predictions), BATCH_LIMIT):
+        batch = db.batch()
+        for match_id, (home_goals, away_goals) in predictions[i:i + BATCH_LIMIT]:
+            batch.set(db.collection('predictions').document(prediction_doc_id(match_id, user_id)), {
+                'user_id': user_id,
+                'match_id': match_id,
+                'home_goals': home_goals,
+                'away_goals': away_goals,
+                'points': 1
+            }, merge=True)
+        commit(batch)
+
+    if user_id in prediction_cache:
+        for match_id, (home_goals, away_goals) in predictions:
+            prediction_cache[user_id][1][match_id] = {
+                'user_id': user_id,
+                'match_id': match_id,
+                'home_goals': home_goals,
+                'away_goals': away_goals,
+                'points': 1
+            }
 
 def get_leaderboard():
-    users_ref = db.collection('users')
-    leaderboard = {}
-    for user in users_ref.stream():
+    return dict(load_leaderboard()['ranking'])
+
+def build_leaderboard(points_by_user, generation=None):
+    ranking = sorted(points_by_user.items(), key=lambda x: x[1], reverse=True)
+    return {'ranking': ranking, 'ranks': {user_id: i for i, (user_id, _) in enumerate(ranking)}, 'generation': generation}
+
+def new_generation():
+    # A fresh token for every leaderboard written to Firestore
+    return uuid.uuid4().hex
+
+def load_leaderboard():
+    global leaderboard_cache
+    if leaderboard_cache is not None:
+        return leaderboard_cache
+
+    meta = get_document(db.collection('leaderboard').document('meta'))
+    if not meta.exists or meta.to_dict().get('dirty'):
+        # No snapshot yet, or a settlement was interrupted: rebuild it from the users collection
+        return rebuild_leaderboard()
+
+    shard_refs = [db.collection('leaderboard').document(f'shard_{i}') for i in range(meta.to_dict().get('shards', 0))]
+    points_by_user = {}
+    for shard in get_all(shard_refs):
+        for entry in (shard.to_dict() or {}).get('ranking', []):
+            points_by_user[entry['user_id']] = entry['points']
+    leaderboard_cache = build_leaderboard(points_by_user, meta.to_dict().get('generation'))
+    return leaderboard_cache
+
+def get_leaderboard_state():
+    # Returns (generation, ranking) of the same leaderboard, for the local snapshot
+    leaderboard = load_leaderboard()
+    return leaderboard['generation'], leaderboard['ranking']
+
+def restore_leaderboard(ranking, generation):
+    # Seed the in-memory leaderboard from the local snapshot, but only when it is the
+    # leaderboard that is stored: not dirty from an interrupted settlement, and not
+    # replaced by a settlement the snapshot was not written for
+    global leaderboard_cache
+    if leaderboard_cache is not None or generation is None:
+        return
+    meta = get_document(db.collection('leaderboard').document('meta'))
+    if meta.exists and not meta.to_dict().get('dirty') and meta.to_dict().get('generation') == generation:
+        leaderboard_cache = build_leaderboard(dict(ranking), generation)
+
+def rebuild_leaderboard():
+    global leaderboard_cache
+    points_by_user = {}
+    for user in stream(db.collection('users')):
         user_data = user.to_dict()
-        user_id = user_data.get('user_id', 'unknown user')
-        leaderboard[user_id] = user_data.get('points', 0)
-    return leaderboard
+        points_by_user[user_data.get('user_id', 'unknown user')] = user_data.get('points', 0)
+    leaderboard_cache = build_leaderboard(points_by_user, new_generation())
+    save_leaderboard_snapshot()
+    return leaderboard_cache
+
+def save_leaderboard_snapshot():
+    ranking = leaderboard_cache['ranking']
+    shard_count = (len(ranking) + LEADERBOARD_SHARD_SIZE - 1) // LEADERBOARD_SHARD_SIZE
+    batch = db.batch()
+    for i in range(shard_count):
+        shard = ranking[i * LEADERBOARD_SHARD_SIZE:(i + 1) * LEADERBOARD_SHARD_SIZE]
+        batch.set(db.collection('leaderboard').document(f'shard_{i}'), {
+            'ranking': [{'user_id': user_id, 'points': points} for user_id, points in shard]
+        })
+    batch.set(db.collection('leaderboard').document('meta'), {'shards': shard_count, 'dirty': False, 'generation': leaderboard_cache['generation']})
+    commit(batch)
+
+def mark_leaderboard_dirty():
+    record_firestore('write', 1)
+    db.collection('leaderboard').document('meta').set({'dirty': True}, merge=True)
+
+def apply_leaderboard_points(user_points):
+    # Apply the point deltas of a settlement to the in-memory copy and persist the new ranking
+    global leaderboard_cache
+    points_by_user = dict(leaderboard_cache['ranking'])
+    for user_id, points in user_points.items():
+        points_by_user[user_id] = points_by_user.get(user_id, 0) + points
+    leaderboard_cache = build_leaderboard(points_by_user, new_generation())
+    save_leaderboard_snapshot()
+
+def get_top_users(n=None):
+    if leaderboard_cache is None and n is not None:
+        meta = get_document(db.collection('leaderboard').document('meta'))
+        if not meta.exists or meta.to_dict().get('dirty'):
+            # Without a usable snapshot, let Firestore do the sorting instead of scanning every user
+            query = db.collection('users').order_by('points', direction=firestore.Query.DESCENDING).limit(n)
+            return [(user.get('user_id'), user.get('points')) for user in stream(query)]
+    ranking = load_leaderboard()['ranking']
+    return ranking if n is None else ranking[:n]
+
+def get_user_rank(user_id):
+    # Returns (rank, points) with rank starting at 1, or None for users without points
+    leaderboard = load_leaderboard()
+    index = leaderboard['ranks'].get(user_id)
+    if index is None:
+        return None
+    return index + 1, leaderboard['ranking'][index][1]
 
 def get_predictions_match(match_id):
     # predictions_ref = db.collection('predictions').where('match_id', '==', match_id)
     predictions_ref = db.collection('predictions').where(filter=FieldFilter('match_id', '==', match_id))
     predictions = {}
-    for prediction in predictions_ref.stream():
+    for prediction in stream(predictions_ref):
         predictions[prediction.id] = prediction.to_dict()
     return predictions
 
 def get_predictions_user_match(user_id, match_id):
-    # predictions_ref = db.collection('predictions').where('user_id', '==', user_id).where('match_id', '==', match_id)
-    predictions_ref = db.collection('predictions').where(filter=FieldFilter('user_id', '==', user_id)).where(filter=FieldFilter('match_id', '==', match_id))
-    prediction = None
-    for prediction in predictions_ref.stream():
-        prediction = prediction.to_dict()
-    return prediction
+    prediction = get_document(db.collection('predictions').document(prediction_doc_id(match_id, user_id)))
+    return prediction.to_dict() if prediction.exists else None
+
+def get_predictions_user_matches(user_id, match_ids):
+    # Returns {match_id: prediction or None} for all matches, read with one batched get
+    cached = prediction_cache.get(user_id)
+    if cached and cached[0] > time.monotonic() and all(match_id in cached[1] for match_id in match_ids):
+        return {match_id: cached[1][match_id] for match_id in match_ids}
+
+    prediction_refs = [db.collection('predictions').document(prediction_doc_id(match_id, user_id)) for match_id in match_ids]
+    predictions = {match_id: None for match_id in match_ids}
+    for prediction in get_all(prediction_refs):
+        if prediction.exists:
+            predictions[prediction.get('match_id')] = prediction.to_dict()
+
+    prediction_cache[user_id] = (time.monotonic() + PREDICTION_CACHE_TTL, predictions)
+    return predictions
 
 def update_prediction_points(prediction_id, points):
     prediciton_ref = db.collection('predictions').document(prediction_id)
+    record_firestore('write', 1)
     prediciton_ref.update({
         'points': points
     })
@@ -99,7 +353,7 @@ def update_game_result(match_id, home_score, away_score, match_date, home_team,
 
     try:
         # Fetch the document
-        doc = game_ref.get()
+        doc = get_document(game_ref)
         
         if doc.exists:
             game_data = doc.to_dict()
@@ -114,6 +368,7 @@ def update_game_result(match_id, home_score, away_score, match_date, home_team,
         print(f"An error occurred: {e}")
 
 
+    record_firestore('write', 1)
     game_ref.set({
         'home_score': home_score,
         'away_score': away_score,
@@ -125,121 +380,255 @@ def update_game_result(match_id, home_score, away_score, match_date, home_team,
     return False
 
 def update_user_points(user_id, points):
-    # Query to find user by user_id
-    user_ref = db.collection('users').where(filter=FieldFilter('user_id', '==', user_id))
-    user_docs = user_ref.get()
-
-    if user_docs:  # Check if the list is not empty
-        # Assuming there is only one document matching the user_id
-        user_doc = user_docs[0].reference  # Get the reference to the first (and presumably only) document
-        user_snapshot = user_doc.get()  # Retrieve the document snapshot
-
-        if user_snapshot.exists:  # Check if the document exists
-            user_data = user_snapshot.to_dict()  # Convert the snapshot to a dictionary
-            new_points = user_data.get('points', 0) + points
-            user_doc.update({'points': new_points})
-        else:
-            # If the document somehow doesn't exist, create a new one
-            db.collection('users').add({'points': points, 'user_id': user_id, 'reminders': True})
-    else:
-        # If the user does not exist, create a new document
-        db.collection('users').add({'points': points, 'user_id': user_id, 'reminders': True})
-
+    with registry_lock:
+        entry = get_user_entry(user_id)
+        entry['points'] += points
+        queue_user_write(user_id, points=points)
+
+def get_finished_game_ids(match_ids):
+    # Fetch all game documents in one round trip and keep the ones already settled
+    game_refs = [db.collection('games').document(match_id) for match_id in match_ids]
+    finished_ids = set()
+    for game in get_all(game_refs):
+        if game.exists and game.to_dict().get('status') == 'finished':
+            finished_ids.add(game.id)
+    return finished_ids
+
+def get_settled_game_ids():
+    # Only the document IDs are needed, so no fields are transferred
+    query = db.collection('games').where(filter=FieldFilter('status', '==', 'finished')).select([])
+    return [game.id for game in stream(query)]
+
+def get_predictions_matches(match_ids):
+    # Fetch the predictions of several matches with chunked 'in' queries
+    predictions = {match_id: {} for match_id in match_ids}
+    for i in range(0, len(match_ids), IN_QUERY_LIMIT):
+        chunk = match_ids[i:i + IN_QUERY_LIMIT]
+        query = db.collection('predictions').where(filter=FieldFilter('match_id', 'in', chunk))
+        for prediction in stream(query):
+            pred_data = prediction.to_dict()
+            predictions[pred_data['match_id']][prediction.id] = pred_data
+    return predictions
 
-def get_past_predictions(user_id, begin_date, end_date):
-    # Parse the date strings into datetime objects
-    begin_date = datetime.strptime(begin_date, "%d/%m/%Y").date()
-    end_date = datetime.strptime(end_date, "%d/%m/%Y").date()
+def get_user_refs():
+    with registry_lock:
+        return {user_id: entry['ref'] for user_id, entry in user_registry.items()}
+
+def get_display_names(user_ids):
+    with registry_lock:
+        return {user_id: user_registry[user_id]['display_name'] for user_id in user_ids
+                if user_id in user_registry and user_registry[user_id]['display_name']}
+
+def save_display_names(names):
+    with registry_lock:
+        for user_id, display_name in names.items():
+            if user_id in user_registry and user_registry[user_id]['display_name'] != display_name:
+                user_registry[user_id]['display_name'] = display_name
+                queue_user_write(user_id, {'display_name': display_name})
+
+def commit_settlement(settlements):
+    # settlements is a list of (match_id, game_data, [(prediction_id, user_id, points), ...])
+    # Every prediction is marked as settled in the same batch as its user's Increment, so
+    # a crash between batches never counts a prediction twice. A game is only marked
+    # 'finished' once all of its predictions have been committed.
+    scored = [(prediction_id, user_id, points, game_data) for _, game_data, predictions in settlements for prediction_id, user_id, points in predictions]
+
+    # Strict durability: new users and queued user changes are written before the settlement
+    for _, user_id, _, _ in scored:
+        get_user_entry(user_id)
+    flush_user_writes()
+    user_refs = get_user_refs()
+
+    # The leaderboard snapshot stays marked dirty until the new totals are written
+    drop_stale_leaderboard()
+    load_leaderboard()
+    mark_leaderboard_dirty()
+    try:
+        commit_settlement_batches(settlements, scored, user_refs)
+    except Exception:
+        invalidate_leaderboard()
+        raise
+
+    settled_points = defaultdict(int)
+    for _, user_id, points, _ in scored:
+        settled_points[user_id] += points
+        history_cache.pop(user_id, None)
+    with registry_lock:
+        for user_id, points in settled_points.items():
+            user_registry[user_id]['points'] += points
+    apply_leaderboard_points(settled_points)
+
+def invalidate_leaderboard():
+    global leaderboard_cache
+    leaderboard_cache = None
+
+def drop_stale_leaderboard():
+    # rescore_season, migrate_predictions and imports replace the stored leaderboard behind
+    # the bot's back; deltas must never be applied to a cached copy older than the stored one
+    if leaderboard_cache is None:
+        return
+    meta = get_document(db.collection('leaderboard').document('meta'))
+    meta_data = meta.to_dict() if meta.exists else {}
+    if meta_data.get('dirty') or meta_data.get('generation') != leaderboard_cache['generation']:
+        invalidate_leaderboard()
+
+def commit_settlement_batches(settlements, scored, user_refs):
+    # Each prediction costs at most two writes (its own update and its user's Increment)
+    chunk_size = BATCH_LIMIT // 2
+    for i in range(0, len(scored), chunk_size):
+        batch = db.batch()
+        user_points = defaultdict(int)
+        for prediction_id, user_id, points, game_data in scored[i:i + chunk_size]:
+            # The game's date and result are copied onto the prediction for the history query
+            batch.update(db.collection('predictions').document(prediction_id), dict(game_data, points=points, settled=True))
+            user_points[user_id] += points
+
+        for user_id, points in user_points.items():
+            batch.update(user_refs[user_id], {'points': firestore.Increment(points)})
+        commit(batch)
+
+    for i in range(0, len(settlements), BATCH_LIMIT):
+        batch = db.batch()
+        for match_id, game_data, _ in settlements[i:i + BATCH_LIMIT]:
+            batch.set(db.collection('games').document(match_id), dict(game_data, status='finished'))
+        commit(batch)
+
+def get_settled_history(user_id):
+    if user_id in history_cache:
+        return history_cache[user_id]
 
     # Fetch all predictions for the given user_id
-    # predictions_ref = db.collection('predictions').where('user_id', '==', user_id)
     predictions_ref = db.collection('predictions').where(filter=FieldFilter('user_id', '==', user_id))
-    predictions = predictions_ref.stream()
-
-    # Use a dictionary to group games by date and time
-    result = defaultdict(lambda: defaultdict(list))
+    predictions = [prediction.to_dict() for prediction in stream(predictions_ref)]
+
+    # Predictions settled before the game data was copied onto them need their game document,
+    # all fetched in one batch
+    legacy_ids = {pred_data.get('match_id') for pred_data in predictions if 'date' not in pred_data}
+    games = {}
+    if legacy_ids:
+        game_refs = [db.collection('games').document(match_id) for match_id in legacy_ids]
+        games = {game.id: game.to_dict() for game in get_all(game_refs) if game.exists}
+
+    history = []
+    for pred_data in predictions:
+        if 'date' in pred_data:
+            game_data = pred_data if pred_data.get('settled') else None
+        else:
+            game_data = games.get(pred_data.get('match_id'))
+            if game_data and game_data.get('status') != 'finished':
+                game_data = None
+        # Only finished games are part of the history
+        if game_data:
+            history.append({
+                'date': game_data.get('date'),
+                'home_team': game_data.get('home_team'),
+                'away_team': game_data.get('away_team'),
+                'actual_home_goals': game_data.get('home_score'),
+                'actual_away_goals': game_data.get('away_score'),
+                'predicted_home_goals': pred_data.get('home_goals'),
+                'predicted_away_goals': pred_data.get('away_goals'),
+                'points': pred_data.get('points', 0)
+            })
 
-    # Define timezones
-    utc = pytz.UTC
-    belgian_tz = pytz.timezone('Europe/Brussels')
+    history_cache[user_id] = history
+    return history
 
-    for prediction in predictions:
+def get_season_predictions():
+    # All predictions of finished games, each paired with its game data
+    games = {}
+    for game in stream(db.collection('games').where(filter=FieldFilter('status', '==', 'finished'))):
+        games[game.id] = game.to_dict()
+    season_predictions = []
+    for prediction in stream(db.collection('predictions')):
         pred_data = prediction.to_dict()
-        match_id = pred_data.get('match_id')
-
-        # Fetch the actual game result from the 'games' collection
-        game_ref = db.collection('games').document(match_id)
-        game = game_ref.get()
-        game_data = game.to_dict()
-
-        # Check if the game has finished and is within the date range
-        if game_data and game_data.get('status') == 'finished':
-            # Parse the full UTC date-time string
-            game_date_utc_str = game_data.get('date')
-            game_date_utc = datetime.strptime(game_date_utc_str, "%Y-%m-%dT%H:%M:%SZ")
-            game_date_utc = utc.localize(game_date_utc)  # Localize to UTC
-
-            # Convert to Belgian time
-            game_date_belgian = game_date_utc.astimezone(belgian_tz)
-
-            # Extract date and time separately
-            game_date = game_date_belgian.date()  # This is now a date object
-            game_time = game_date_belgian.strftime("%H:%M")
-
-            # Only consider games within the specified date range
-            if begin_date <= game_date <= end_date:
-                # Collect game information
-                home_team = game_data.get('home_team')
-                away_team = game_data.get('away_team')
-                actual_home_goals = game_data.get('home_score')
-                actual_away_goals = game_data.get('away_score')
-
-                # Prediction data
-                predicted_home_goals = pred_data.get('home_goals')
-                predicted_away_goals = pred_data.get('away_goals')
-                points = pred_data.get('points', 0)
-
-                # Store the results grouped by date and time
-                result[game_date.strftime("%d/%m/%Y")][game_time].append({
-                    'home_team': home_team,
-                    'away_team': away_team,
-                    'actual_home_goals': actual_home_goals,
-                    'actual_away_goals': actual_away_goals,
-                    'predicted_home_goals': predicted_home_goals,
-                    'predicted_away_goals': predicted_away_goals,
-                    'points': points
-                })
-
-    return result
+        if pred_data.get('match_id') in games:
+            season_predictions.append((prediction.id, pred_data, games[pred_data['match_id']]))
+    return season_predictions
+
+def apply_rescore(prediction_points, user_totals):
+    # Overwrite prediction points and user totals, then rebuild the leaderboard from the new totals
+    flush_user_writes()
+    user_refs = get_user_refs()
+    writes = [(db.collection('predictions').document(prediction_id), {'points': points}) for prediction_id, points in prediction_points.items()]
+    writes += [(user_refs[user_id], {'points': points}) for user_id, points in user_totals.items() if user_id in user_refs]
+
+    mark_leaderboard_dirty()
+    for i in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for ref, data in writes[i:i + BATCH_LIMIT]:
+            batch.update(ref, data)
+        commit(batch)
+    with registry_lock:
+        for user_id, points in user_totals.items():
+            if user_id in user_registry:
+                user_registry[user_id]['points'] = points
+    history_cache.clear()
+    rebuild_leaderboard()
+
+def get_past_predictions(user_id, begin_date, end_date):
+    return group_past_predictions(get_settled_history(user_id), begin_date, end_date)
 
 def get_users_without_predictions(match_id):
     # Replace with actual Firestore logic to get user predictions
     all_users = get_all_registered_users()  # Assume this function returns a list of user IDs
-    users_with_predictions = get_users_with_prediction_for_match(match_id)  # Assume this returns a list of user IDs who have predicted
+    users_with_predictions = set(get_users_with_prediction_for_match(match_id))  # Assume this returns a list of user IDs who have predicted
     
     users_without_predictions = [user for user in all_users if user not in users_with_predictions]
     
     return users_without_predictions
 
-def get_all_registered_users():
-    # Reference to the 'users' collection
-    users_collection_ref = db.collection('users')
-
-    # Get all documents from the 'users' collection
-    user_documents = users_collection_ref.stream()
-
-    # List to store user IDs
-    user_ids = []
-
-    # Iterate through each document
-    for user_doc in user_documents:
-        user_data = user_doc.to_dict()
-        
-        # Check if the 'user_id' key exists in the document
-        if 'user_id' in user_data:
-            user_ids.append(user_data['user_id'])
+def get_reminder_targets(match_ids):
+    # Returns {user_id: [match_id, ...]} with every match a reminder-enabled user has not predicted
+    with registry_lock:
+        reminder_users = {user_id for user_id, entry in user_registry.items() if entry['reminders']}
+
+    # Load who predicted which match for all matches in one pass
+    predictors = {match_id: set() for match_id in match_ids}
+    for i in range(0, len(match_ids), IN_QUERY_LIMIT):
+        chunk = match_ids[i:i + IN_QUERY_LIMIT]
+        query = db.collection('predictions').where(filter=FieldFilter('match_id', 'in', chunk)).select(['user_id', 'match_id'])
+        for prediction in stream(query):
+            predictors[prediction.get('match_id')].add(prediction.get('user_id'))
+
+    targets = defaultdict(list)
+    for match_id in match_ids:
+        for user_id in reminder_users - predictors[match_id]:
+            targets[user_id].append(match_id)
+    return dict(targets)
+
+def ledger_shard(user_id):
+    # Stable across processes, unlike hash()
+    return zlib.crc32(user_id.encode()) % REMINDER_LEDGER_SHARDS
+
+def ledger_ref(match_id, shard):
+    return db.collection('reminder_ledger').document(f'{match_id}_{shard}')
+
+def get_reminder_ledger(match_ids):
+    # Returns {match_id: set of user_ids} that were already reminded about each match
+    ledger_refs = [ledger_ref(match_id, shard) for match_id in match_ids for shard in range(REMINDER_LEDGER_SHARDS)]
+    ledger = {match_id: set() for match_id in match_ids}
+    for ledger_doc in get_all(ledger_refs):
+        if ledger_doc.exists:
+            ledger_data = ledger_doc.to_dict()
+            ledger[ledger_data['match_id']].update(ledger_data.get('user_ids', []))
+    return ledger
+
+def record_reminders(match_users):
+    # match_users is {match_id: [user_id, ...]}, one ArrayUnion per match and shard
+    writes = defaultdict(list)
+    for match_id, user_ids in match_users.items():
+        for user_id in user_ids:
+            writes[(match_id, ledger_shard(user_id))].append(user_id)
+    writes = list(writes.items())
+    for i in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for (match_id, shard), user_ids in writes[i:i + BATCH_LIMIT]:
+            batch.set(ledger_ref(match_id, shard), {'match_id': match_id, 'user_ids': firestore.ArrayUnion(user_ids)}, merge=True)
+        commit(batch)
 
-    return user_ids
+def get_all_registered_users():
+    with registry_lock:
+        return list(user_registry)
 
 def get_users_with_prediction_for_match(match_id):
     # Reference to the 'predictions' collection
@@ -250,7 +639,7 @@ def get_users_with_prediction_for_match(match_id):
     query = predictions_collection_ref.where(filter=FieldFilter('match_id', '==', match_id))
 
     # Execute the query and get matching documents
-    prediction_documents = query.stream()
+    prediction_documents = stream(query)
 
     # List to store user IDs
     user_ids = []
@@ -265,44 +654,61 @@ def get_users_with_prediction_for_match(match_id):
 
     return user_ids
 
-def enable_reminder(user_id):
-    # Query to find user by user_id
-    user_ref = db.collection('users').where(filter=FieldFilter('user_id', '==', user_id))
-    user_docs = user_ref.get()
-
-    if user_docs:  # Check if the list is not empty
-        # Assuming there is only one document matching the user_id
-        user_doc = user_docs[0].reference  # Get the reference to the first (and presumably only) document
-        user_doc.update({'reminders': True})
-    else:
-        # If the user does not exist, create a new document
-        db.collection('users').add({'points': 0, 'user_id': user_id, 'reminders': True})
+def set_reminder(user_id, reminders):
+    # A memory lookup, the change itself is written by the next flush
+    with registry_lock:
+        entry = get_user_entry(user_id, reminders)
+        if entry['reminders'] != reminders:
+            entry['reminders'] = reminders
+            queue_user_write(user_id, {'reminders': reminders})
 
+def enable_reminder(user_id):
+    set_reminder(user_id, True)
 
 def disable_reminder(user_id):
-    # Query to find user by user_id
-    user_ref = db.collection('users').where(filter=FieldFilter('user_id', '==', user_id))
-    user_docs = user_ref.get()
-
-    if user_docs:  # Check if the list is not empty
-        # Assuming there is only one document matching the user_id
-        user_doc = user_docs[0].reference  # Get the reference to the first (and presumably only) document
-        user_doc.update({'reminders': False})
-    else:
-        # If the user does not exist, create a new document
-        db.collection('users').add({'points': 0, 'user_id': user_id, 'reminders': False})
-
+    set_reminder(user_id, False)
 
 def check_reminder_messages(user_id):
-    # Query to find user by user_id
-    user_ref = db.collection('users').where(filter=FieldFilter('user_id', '==', user_id))
-    user_docs = user_ref.get()
-
-    if not user_docs:  # Check if the list is empty
-        return False  # Return False if no user is found
-
-    # Assuming there is only one document matching the user_id
-    user_data = user_docs[0].to_dict()  # Get the document data as a dictionary
-    return user_data.get('reminders', False)  # Return the value of 'reminders', default to False if not found
-
-        
+    with registry_lock:
+        entry = user_registry.get(user_id)
+        return bool(entry and entry['reminders'])
+
+def export_data():
+    users = [user.to_dict() for user in stream(db.collection('users'))]
+    predictions = [dict(prediction.to_dict(), prediction_id=prediction.id) for prediction in stream(db.collection('predictions'))]
+    games = [dict(game.to_dict(), match_id=game.id) for game in stream(db.collection('games'))]
+    ledger = defaultdict(list)
+    for entry in stream(db.collection('reminder_ledger')):
+        entry_data = entry.to_dict()
+        ledger[entry_data['match_id']].extend(entry_data.get('user_ids', []))
+    reminder_ledger = [{'match_id': match_id, 'user_ids': user_ids} for match_id, user_ids in ledger.items()]
+    return {'users': users, 'predictions': predictions, 'games': games, 'reminder_ledger': reminder_ledger}
+
+def import_data(data):
+    user_refs = get_user_refs()
+    writes = []
+    for user in data['users']:
+        user_ref = user_refs.get(user['user_id']) or db.collection('users').document(user['user_id'])
+        writes.append((user_ref, {key: value for key, value in user.items() if value is not None}))
+    for prediction in data['predictions']:
+        prediction_data = {key: value for key, value in prediction.items() if key != 'prediction_id' and value is not None}
+        writes.append((db.collection('predictions').document(prediction['prediction_id']), prediction_data))
+    for game in data['games']:
+        game_data = {key: value for key, value in game.items() if key != 'match_id' and value is not None}
+        writes.append((db.collection('games').document(game['match_id']), game_data))
+    ledger_shards = defaultdict(list)
+    for entry in data['reminder_ledger']:
+        for user_id in entry['user_ids']:
+            ledger_shards[(entry['match_id'], ledger_shard(user_id))].append(user_id)
+    for (match_id, shard), user_ids in ledger_shards.items():
+        writes.append((ledger_ref(match_id, shard), {'match_id': match_id, 'user_ids': user_ids}))
+
+    # The leaderboard snapshot is rebuilt from the imported users on its next load
+    mark_leaderboard_dirty()
+    invalidate_leaderboard()
+    for i in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for ref, document_data in writes[i:i + BATCH_LIMIT]:
+            batch.set(ref, document_data)
+        commit(batch)
+    load_user_registry()
@@ -0,0 +1,86 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+import pytz
+
+BRUSSELS = pytz.timezone('Europe/Brussels')
+SCHEDULED_STATUSES = ('SCHEDULED', 'TIMED')
+LIVE_STATUSES = ('IN_PLAY', 'PAUSED')
+
+class Match:
+    # One fixture of the season feed, with its kickoff parsed once
+    __slots__ = ('id', 'stage', 'matchday', 'status', 'utc_date', 'kickoff', 'local_kickoff',
+                 'home_team', 'away_team', 'home_score', 'away_score', 'last_updated')
+
+    def __init__(self, match):
+        self.id = str(match['id'])
+        self.stage = match.get('stage')
+        self.matchday = match.get('matchday')
+        self.status = match['status']
+        self.utc_date = match['utcDate']
+        self.kickoff = datetime.strptime(match['utcDate'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=pytz.utc)
+        self.local_kickoff = self.kickoff.astimezone(BRUSSELS)
+        self.home_team = match['homeTeam']['name']
+        self.away_team = match['awayTeam']['name']
+        full_time = (match.get('score') or {}).get('fullTime') or {}
+        self.home_score = full_time.get('home')
+        self.away_score = full_time.get('away')
+        self.last_updated = match.get('lastUpdated')
+
+    @property
+    def matchday_key(self):
+        return (self.stage, self.matchday)
+
+    @property
+    def is_live(self):
+        return self.status in LIVE_STATUSES
+
+    @property
+    def is_scheduled(self):
+        return self.status in SCHEDULED_STATUSES
+
+class FixtureIndex:
+    # The season's matches sorted by kickoff, with lookups by ID and by (stage, matchday)
+    __slots__ = ('source', 'matches', 'kickoffs', 'by_id', 'by_matchday', 'first_open')
+
+    def __init__(self, source):
+        self.source = source
+        self.matches = sorted((Match(match) for match in source), key=lambda match: (match.kickoff, match.id))
+        self.kickoffs = [match.kickoff for match in self.matches]
+        self.by_id = {match.id: match for match in self.matches}
+        self.by_matchday = {}
+        for match in self.matches:
+            self.by_matchday.setdefault(match.matchday_key, []).append(match)
+        # Position of the first match that is in play or part of a partially played matchday;
+        # whether a matchday is over otherwise only depends on its kickoffs
+        partially_played = {key for key, group in self.by_matchday.items()
+                            if any(match.is_scheduled for match in group) and not all(match.is_scheduled for match in group)}
+        self.first_open = next((i for i, match in enumerate(self.matches) if match.is_live or match.matchday_key in partially_played), len(self.matches))
+
+    def kicked_off_between(self, start, end):
+        # Matches with start <= kickoff <= end, either bound may be None
+        low = bisect_left(self.kickoffs, start) if start else 0
+        high = bisect_right(self.kickoffs, end) if end else len(self.kickoffs)
+        return self.matches[low:high]
+
+    def next_matchday(self, now):
+        # Returns (unplayed, ongoing or future) matches of the first matchday that is not over
+        seen = set()
+        for match in self.matches[min(self.first_open, bisect_right(self.kickoffs, now)):]:
+            if match.matchday_key in seen:
+                continue
+            seen.add(match.matchday_key)
+            group = self.by_matchday[match.matchday_key]
+            unplayed = [match for match in group if match.is_scheduled]
+            ongoing = [match for match in group if match.is_live or match.kickoff > now]
+            if ongoing or (unplayed and len(unplayed) < len(group)):
+                return unplayed, ongoing
+        return [], []
+
+# Index of the last fixture list seen; the feed cache hands out the same list until it changes
+fixture_index = None
+
+def index_fixtures(matches):
+    global fixture_index
+    if fixture_index is None or fixture_index.source is not matches:
+        fixture_index = FixtureIndex(matches)
+    return fixture_index
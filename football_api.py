@@ -1,5 +1,9 @@
 import os
-import requests
+import time
+import asyncio
+import aiohttp
+from rate_limit import TokenBucket
+from fixtures import index_fixtures
 from datetime import datetime, timedelta
 import pytz
 from dotenv import load_dotenv
@@ -8,52 +12,118 @@ from dotenv import load_dotenv
 load_dotenv()
 
 API_KEY = os.getenv('FOOTBALL_API_KEY')
+MATCHES_URL = "https://api.football-data.org/v4/competitions/CL/matches"
 
-def get_next_matchday_matches():
-    # Fetch all matches with relevant statuses
-    response = requests.get(
-        "https://api.football-data.org/v4/competitions/CL/matches",
-        headers={'X-Auth-Token': API_KEY}
-    )
-
-    # Parse response
-    matches = response.json().get('matches', [])
-    if not matches:
-        return [],[]
-    
-    # Group matches by stage and matchday combination
-    grouped_matches = {}
-    for match in matches:
-        key = (match['stage'], match['matchday'])
-        if key not in grouped_matches:
-            grouped_matches[key] = []
-        grouped_matches[key].append(match)
-
-    # Find the current date and time in UTC
-    current_time = datetime.utcnow().replace(tzinfo=pytz.utc)
-    
-    for (stage, matchday), match_list in grouped_matches.items():
-        # Check if any match is in 'IN_PLAY', 'SCHEDULED', or 'TIMED' status
-        unplayed_matches = [
-            match for match in match_list
-            if match['status'] in ['SCHEDULED', 'TIMED']
-        ]
-        
-        # Check if any match is ongoing or scheduled for a future date
-        ongoing_or_future_matches = [
-            match for match in match_list
-            if match['status'] == 'IN_PLAY' or match['status'] == 'PAUSED'  or datetime.strptime(match['utcDate'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=pytz.utc) > current_time
-        ]
-        # If there are both played and unplayed matches in this stage and matchday, return them
-        if (unplayed_matches and len(unplayed_matches) < len(match_list) and len(unplayed_matches) > 0) or (len(unplayed_matches) == 0 and len(ongoing_or_future_matches) > 0):
-            return unplayed_matches, ongoing_or_future_matches
-
-         # If no matches have been played yet and some are upcoming, return those
-        if ongoing_or_future_matches:
-            return unplayed_matches, ongoing_or_future_matches
-
-    # If no ongoing or unplayed matches found, return an empty list
-    return [],[]
+# One pooled HTTP session for the whole process
+session = None
+
+# Cache lifetimes in seconds per endpoint: (during a live window, when no match is near)
+CACHE_TTL = {
+    'matches': (60, 3600),
+    'FINISHED': (120, 3600)
+}
+# A live window starts a bit before kickoff and lasts until well after full time
+LIVE_WINDOW_BEFORE = timedelta(minutes=15)
+LIVE_WINDOW_AFTER = timedelta(hours=3)
+
+# The free tier allows 10 requests per minute
+RATE_LIMIT_REQUESTS = 10
+RATE_LIMIT_PERIOD = 60
+
+feed_cache = {}
+in_flight = {}
+feed_stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'requests': 0, 'rate_limited': 0}
+
+rate_limiter = TokenBucket(RATE_LIMIT_REQUESTS, RATE_LIMIT_PERIOD)
+
+def get_session():
+    global session
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            headers={'X-Auth-Token': API_KEY},
+            timeout=aiohttp.ClientTimeout(total=15)
+        )
+    return session
+
+async def close_session():
+    global session
+    if session is not None and not session.closed:
+        await session.close()
+    session = None
+
+def is_live_window(now=None):
+    # Use the last known season fixture list to see whether a match is being played
+    entry = feed_cache.get(())
+    if entry is None:
+        return False
+    now = now or datetime.utcnow().replace(tzinfo=pytz.utc)
+    index = index_fixtures(entry['matches'])
+    # A kickoff within the window around now, or a match the feed still reports as in play
+    if index.kicked_off_between(now - LIVE_WINDOW_AFTER, now + LIVE_WINDOW_BEFORE):
+        return True
+    return any(match.is_live for match in index.matches)
+
+def cache_ttl(params):
+    live_ttl, idle_ttl = CACHE_TTL.get(params.get('status', 'matches'), CACHE_TTL['matches'])
+    return live_ttl if is_live_window() else idle_ttl
+
+def get_feed_stats():
+    return dict(feed_stats, remaining_budget=rate_limiter.remaining(), cached_entries=len(feed_cache))
+
+async def request_matches(key, params):
+    entry = feed_cache.get(key)
+    headers = {}
+    if entry and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+
+    await rate_limiter.acquire()
+    feed_stats['requests'] += 1
+    async with get_session().get(MATCHES_URL, params=params, headers=headers) as response:
+        if response.status == 304 and entry:
+            feed_stats['not_modified'] += 1
+            entry['fetched_at'] = time.monotonic()
+            return entry['matches']
+        if response.status == 429 and entry:
+            # Serve the stale copy rather than failing the caller
+            feed_stats['rate_limited'] += 1
+            return entry['matches']
+        response.raise_for_status()
+        data = await response.json()
+        etag = response.headers.get('ETag')
+
+    matches = data.get('matches', [])
+    if 'dateFrom' in params:
+        # Result checks move their date window along with the pending matches; an older
+        # window is never asked for again, so only the newest one is kept
+        for old_key in [old_key for old_key in feed_cache if old_key != key and 'dateFrom' in dict(old_key)]:
+            del feed_cache[old_key]
+    feed_cache[key] = {'matches': matches, 'etag': etag, 'fetched_at': time.monotonic()}
+    return matches
+
+async def fetch_matches(params=None):
+    params = params or {}
+    key = tuple(sorted(params.items()))
+
+    entry = feed_cache.get(key)
+    if entry and time.monotonic() - entry['fetched_at'] < cache_ttl(params):
+        feed_stats['hits'] += 1
+        return entry['matches']
+    feed_stats['misses'] += 1
+
+    # Concurrent callers for the same resource share one request
+    if key not in in_flight:
+        in_flight[key] = asyncio.ensure_future(request_matches(key, params))
+        in_flight[key].add_done_callback(lambda _: in_flight.pop(key, None))
+    return await asyncio.shield(in_flight[key])
+
+async def get_fixture_index():
+    # The season fixture list as an index that is only rebuilt when the feed changes
+    return index_fixtures(await fetch_matches())
+
+async def get_next_matchday_matches():
+    # Returns (unplayed matches, ongoing or future matches) of the current matchday
+    index = await get_fixture_index()
+    return index.next_matchday(datetime.utcnow().replace(tzinfo=pytz.utc))
 
 def convert_to_belgian_time(utc_time_str):
     utc_time = datetime.strptime(utc_time_str, '%Y-%m-%dT%H:%M:%SZ')
@@ -1,82 +1,138 @@
 import os
-import requests
+import time
 import discord
-from firestore_db import update_game_result, get_predictions_match, update_user_points, get_leaderboard, update_prediction_points
-from football_api import convert_to_belgian_time
+from datetime import datetime
+import pytz
+from storage import backend
+from async_db import run_blocking, get_top_users
+from commands import LEADERBOARD_SIZE, format_leaderboard
+from scoring import score_predictions
+from metrics import timed
+from football_api import fetch_matches, get_fixture_index, convert_to_belgian_time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
-
-API_KEY = os.getenv('FOOTBALL_API_KEY')
 channel_id = int(os.getenv('DISCORD_CHANNEL_ID'))
 
+# Watermark of settled matches: match_id -> 'lastUpdated' of the feed when it was settled
+settled_matches = None
+# Matches with these statuses will not finish at their scheduled kickoff; AWARDED matches
+# get a result without ever being FINISHED in the feed
+NOT_PLAYED_STATUSES = ['POSTPONED', 'CANCELLED', 'SUSPENDED', 'AWARDED']
+
+async def load_settled_matches():
+    global settled_matches
+    if settled_matches is None:
+        settled_matches = {match_id: None for match_id in await run_blocking(backend.get_settled_game_ids)}
+    return settled_matches
+
+async def get_pending_matches():
+    # Matches that kicked off but were not settled yet, according to the (cached) fixture list
+    settled = await load_settled_matches()
+    now = datetime.utcnow().replace(tzinfo=pytz.utc)
+    index = await get_fixture_index()
+    return [
+        match for match in index.kicked_off_between(None, now)
+        if match.id not in settled and match.status not in NOT_PLAYED_STATUSES
+    ]
+
+@timed('task')
 async def check_game_updates(bot):
-    # Fetch UCL games that have finished
-    response = requests.get(
-        "https://api.football-data.org/v4/competitions/CL/matches?status=FINISHED",
-        headers={'X-Auth-Token': API_KEY}
-    )
-    matches = response.json().get('matches', [])
-    for match in matches:
-        match_id = str(match['id'])
+    pending_matches = await get_pending_matches()
+    if not pending_matches:
+        return
+
+    # Only ask for finished matches in the date window of the pending kickoffs
+    kickoff_dates = [match.utc_date[:10] for match in pending_matches]
+    matches = await fetch_matches({'status': 'FINISHED', 'dateFrom': min(kickoff_dates), 'dateTo': max(kickoff_dates)})
+    new_matches = [match for match in matches if str(match['id']) not in settled_matches]
+    if not new_matches:
+        return
+
+    result_messages, summary = await run_blocking(settle_finished_matches, new_matches)
+    for match in new_matches:
+        settled_matches[str(match['id'])] = match.get('lastUpdated')
+    if not result_messages:
+        return
+    print(summary)
+
+    # Send results and updated leaderboard to a specific channel
+    channel = bot.get_channel(channel_id)
+    for result_message in result_messages:
+        await channel.send(result_message)
+    await send_leaderboard(bot)
+
+@timed('task')
+def settle_finished_matches(matches):
+    start = time.perf_counter()
+
+    # Skip every match that was already settled in a previous run
+    matches = {str(match['id']): match for match in matches}
+    finished_ids = backend.get_finished_game_ids(list(matches)) if matches else set()
+    new_matches = {match_id: match for match_id, match in matches.items() if match_id not in finished_ids}
+
+    # Get the predictions of all newly finished matches in one pass
+    predictions = backend.get_predictions_matches(list(new_matches)) if new_matches else {}
+
+    # Lay out all predictions as columns and score them in one pass
+    rows = [(match_id, prediction_id, pred) for match_id in new_matches for prediction_id, pred in predictions[match_id].items()]
+    points = score_predictions(
+        [new_matches[match_id]['score']['fullTime']['home'] for match_id, _, _ in rows],
+        [new_matches[match_id]['score']['fullTime']['away'] for match_id, _, _ in rows],
+        [pred['home_goals'] for _, _, pred in rows],
+        [pred['away_goals'] for _, _, pred in rows],
+        stages=[new_matches[match_id].get('stage') for match_id, _, _ in rows]
+    ).tolist()
+    points_by_prediction = {prediction_id: row_points for (_, prediction_id, _), row_points in zip(rows, points)}
+
+    settlements = []
+    result_messages = []
+    prediction_count = 0
+    for match_id, match in new_matches.items():
         home_team = match['homeTeam']['name']
         away_team = match['awayTeam']['name']
         home_score = match['score']['fullTime']['home']
         away_score = match['score']['fullTime']['away']
-        match_date = match['utcDate']
-
-        # Update the game result in Firestore
-        already_returned = update_game_result(match_id, home_score, away_score, match_date, home_team, away_team)
-        if already_returned: 
-            continue
-        # Get predictions for this match
-        predictions = get_predictions_match(match_id)
+        game_data = {
+            'home_score': home_score,
+            'away_score': away_score,
+            'date': match['utcDate'],
+            'home_team': home_team,
+            'away_team': away_team,
+            'stage': match.get('stage')
+        }
 
-        # Calculate points and update leaderboard
+        scored = []
         result_message = f"Result: {home_team} {home_score} - {away_score} {away_team}\n"
-        for prediction_id, pred in predictions.items():
+        for prediction_id, pred in predictions[match_id].items():
             predicted_home = pred['home_goals']
             predicted_away = pred['away_goals']
             user_id = pred['user_id']
-            points = calculate_points(home_score, away_score, predicted_home, predicted_away)
-            update_prediction_points(prediction_id, points)
-            update_user_points(user_id, points)
+            points = points_by_prediction[prediction_id]
+            # Predictions settled before a crash keep their points and are not counted again
+            if not pred.get('settled'):
+                scored.append((prediction_id, user_id, points))
             result_message += f"<@{user_id}> predicted {predicted_home}-{predicted_away}, earned {points} points\n"
 
-        # Send result and updated leaderboard to a specific channel
-        channel = bot.get_channel(channel_id)
-        await channel.send(result_message)
-        await send_leaderboard(bot)
+        settlements.append((match_id, game_data, scored))
+        result_messages.append(result_message)
+        prediction_count += len(scored)
+
+    # Commit prediction points, user totals and game results in batches
+    if settlements:
+        backend.commit_settlement(settlements)
 
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    summary = f"settled {len(settlements)} matches / {prediction_count} predictions in {elapsed_ms:.0f} ms"
+    return result_messages, summary
+
+@timed('task')
 async def send_leaderboard(bot):
-    # Fetch and sort leaderboard data
-    leaderboard_data = get_leaderboard()
-    sorted_leaderboard = sorted(leaderboard_data.items(), key=lambda x: x[1], reverse=True)
-    
-    # Initialize leaderboard message
-    leaderboard_message = "Updated Leaderboard:\n"
-    
-    # Fetch the users' display names
-    for i, (user_id, points) in enumerate(sorted_leaderboard):
-        user = await bot.fetch_user(user_id)
-        if i < 3:
-            # Format top 3 users with special symbols
-            symbols = ["🥇", "🥈", "🥉"]
-            leaderboard_message += f"{symbols[i]} {user.display_name}: {points}pts\n"
-        else:
-            # Format for 4th place and beyond
-            leaderboard_message += f"{i + 1}) {user.display_name}: {points}pts\n"
+    # Fetch the already sorted top of the leaderboard
+    sorted_leaderboard = await get_top_users(LEADERBOARD_SIZE)
+    leaderboard_message = await format_leaderboard(bot, sorted_leaderboard)
 
     # Send the formatted leaderboard message to a specific channel
     channel = bot.get_channel(channel_id)
     await channel.send(leaderboard_message)
-
-def calculate_points(actual_home, actual_away, predicted_home, predicted_away):
-    if actual_home == predicted_home and actual_away == predicted_away:
-        return 10
-    elif (actual_home - actual_away) == (predicted_home - predicted_away):
-        return 7
-    elif (actual_home > actual_away and predicted_home > predicted_away) or (actual_home < actual_away and predicted_home < predicted_away):
-        return 5
-    return 1
@@ -1,9 +1,75 @@
-import asyncio
 import discord
 from discord.ext import commands
-from discord.ui import View, Button
-from firestore_db import get_past_predictions
+from discord.ui import View, Select, Modal, TextInput
+from async_db import get_past_predictions
+from football_api import get_fixture_index
 from datetime import datetime
+import pytz
+
+# Ranges offered in the dropdown, 'custom' opens a modal for typed dates
+RANGE_PRESETS = [
+    ('matchday', "This matchday"),
+    ('previous_matchday', "Previous matchday"),
+    ('season', "This season"),
+    ('custom', "Custom dates...")
+]
+# Discord rejects messages longer than this
+MESSAGE_LIMIT = 2000
+
+def split_message(lines, limit=MESSAGE_LIMIT):
+    # Pack whole lines into as few messages as possible
+    messages = ['']
+    for line in lines:
+        if messages[-1] and len(messages[-1]) + len(line) > limit:
+            messages.append('')
+        messages[-1] += line
+    return messages
+
+def matchday_dates(group):
+    # Belgian dates, like the grouping of the history itself
+    return group[0].local_kickoff.date(), group[-1].local_kickoff.date()
+
+async def preset_range(preset):
+    # Returns (begin_date, end_date) for a preset, based on the cached fixture index, or None
+    # when there are no fixtures to base it on
+    index = await get_fixture_index()
+    if not index.matches:
+        return None
+    if preset == 'season':
+        return matchday_dates(index.matches)
+
+    # Matchdays that already kicked off, in the order they started
+    now = datetime.utcnow().replace(tzinfo=pytz.utc)
+    started = list(dict.fromkeys(match.matchday_key for match in index.kicked_off_between(None, now)))
+    if not started:
+        return matchday_dates(index.by_matchday[index.matches[0].matchday_key])
+    if preset == 'previous_matchday' and len(started) > 1:
+        return matchday_dates(index.by_matchday[started[-2]])
+    return matchday_dates(index.by_matchday[started[-1]])
+
+class DateRangeModal(Modal, title="Custom date range"):
+    begin = TextInput(label="Begin date", placeholder="dd/mm/yyyy", min_length=8, max_length=10)
+    end = TextInput(label="End date", placeholder="dd/mm/yyyy", min_length=8, max_length=10)
+
+    def __init__(self, parent_view):
+        super().__init__()
+        self.parent_view = parent_view
+
+    async def on_submit(self, interaction: discord.Interaction):
+        try:
+            begin_date = datetime.strptime(self.begin.value.strip(), "%d/%m/%Y").date()
+            end_date = datetime.strptime(self.end.value.strip(), "%d/%m/%Y").date()
+        except ValueError:
+            await interaction.response.send_message("Invalid date format. Please use dd/mm/yyyy.", ephemeral=True)
+            return
+        await self.parent_view.show_history(interaction, begin_date, end_date)
+
+class RangeSelect(Select):
+    def __init__(self):
+        super().__init__(placeholder="Select a period...", options=[discord.SelectOption(label=label, value=value) for value, label in RANGE_PRESETS])
+
+    async def callback(self, interaction: discord.Interaction):
+        await self.view.show_preset(interaction, self.values[0])
 
 class DateSelectionView(View):
     def __init__(self, interaction: discord.Interaction, user_id: str, bot: commands.Bot):
@@ -11,9 +77,7 @@ class DateSelectionView(View):
         self.interaction = interaction
         self.user_id = user_id
         self.bot = bot
-        self.begin_date = None
-        self.end_date = None
-        self.message = None  # To store the original message
+        self.add_item(RangeSelect())
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != int(self.user_id):
@@ -21,102 +85,54 @@ class DateSelectionView(View):
             return False
         return True
 
-    @discord.ui.button(label='Set Begin Date', style=discord.ButtonStyle.primary)
-    async def set_begin_date(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not await self.interaction_check(interaction):
+    async def show_preset(self, interaction: discord.Interaction, preset):
+        if preset == 'custom':
+            await interaction.response.send_modal(DateRangeModal(self))
             return
-        await interaction.response.send_message("Please enter the begin date in dd/mm/yyyy format.", ephemeral=True)
-
-        try:
-            msg = await self.bot.wait_for(
-                'message',
-                timeout=60.0,
-                check=lambda m: m.author == interaction.user and m.channel == interaction.channel
-            )
-            self.begin_date = datetime.strptime(msg.content, "%d/%m/%Y").date()
-            await msg.delete()
-            await interaction.followup.send(f"Begin date set to {self.begin_date}.", ephemeral=True)
-        except ValueError:
-            await interaction.followup.send("Invalid date format. Please use dd/mm/yyyy.", ephemeral=True)
-        except asyncio.TimeoutError:
-            await interaction.followup.send("You took too long to respond.", ephemeral=True)
-            if self.message:
-                await self.message.delete()
+        date_range = await preset_range(preset)
+        if date_range is None:
+            await interaction.response.send_message("No fixtures are available right now. Please pick custom dates instead.", ephemeral=True)
             return
+        await self.show_history(interaction, *date_range)
 
-    @discord.ui.button(label='Set End Date', style=discord.ButtonStyle.primary)
-    async def set_end_date(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not await self.interaction_check(interaction):
+    async def show_history(self, interaction: discord.Interaction, begin_date, end_date):
+        user = interaction.user
+        past_predictions = await get_past_predictions(self.user_id, begin_date.strftime("%d/%m/%Y"), end_date.strftime("%d/%m/%Y"))
+        if not past_predictions:
+            await interaction.response.send_message(f"{user.display_name}, you have no past predictions in the specified time range.", ephemeral=True)
             return
-        await interaction.response.send_message("Please enter the end date in dd/mm/yyyy format.", ephemeral=True)
 
-        try:
-            msg = await self.bot.wait_for(
-                'message',
-                timeout=60.0,
-                check=lambda m: m.author == interaction.user and m.channel == interaction.channel
-            )
-            self.end_date = datetime.strptime(msg.content, "%d/%m/%Y").date()
-            await msg.delete()
-            await interaction.followup.send(f"End date set to {self.end_date}.", ephemeral=True)
-        except ValueError:
-            await interaction.followup.send("Invalid date format. Please use dd/mm/yyyy.", ephemeral=True)
-        except asyncio.TimeoutError:
-            await interaction.followup.send("You took too long to respond.", ephemeral=True)
-            if self.message:
-                await self.message.delete()
-            return
+        lines = [f"{user.display_name}, your Past Predictions:\n"]
+        for date, times in past_predictions.items():
+            lines.append(f"{date}:\n")
+            for time, games in times.items():
+                lines.append(f"{time}:\n")
+                for game in games:
+                    home_team = game['home_team']
+                    away_team = game['away_team']
+                    actual_score = f"{game['actual_home_goals']}-{game['actual_away_goals']}"
+                    predicted_score = f"{game['predicted_home_goals']}-{game['predicted_away_goals']}"
+                    points = game['points']
+                    lines.append(f"    {home_team} vs {away_team}: Predicted {predicted_score}, Actual {actual_score}, Points: {points}\n")
+        # A whole season does not fit in one message, the rest follows in follow-ups
+        first, *rest = split_message(lines)
+        await interaction.response.send_message(first, ephemeral=False)
+        for message in rest:
+            await interaction.followup.send(message, ephemeral=False)
 
-    @discord.ui.button(label='Get History', style=discord.ButtonStyle.green)
-    async def get_history(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.begin_date and self.end_date:
-            user = await self.bot.fetch_user(self.user_id)
-            past_predictions = get_past_predictions(self.user_id, self.begin_date.strftime("%d/%m/%Y"), self.end_date.strftime("%d/%m/%Y"))
-            if not past_predictions:
-                await interaction.response.send_message(f"{user.display_name}, you have no past predictions in the specified time range.", ephemeral=True)
-                for item in self.children:
-                    item.disabled = True
-                if self.message:
-                    await self.message.edit(view=self)
-                    await self.message.delete()
-                return
-
-            response = f"{user.display_name}, your Past Predictions:\n"
-            for date, times in past_predictions.items():
-                response += f"{date}:\n"
-                for time, games in times.items():
-                    response += f"{time}:\n"
-                    for game in games:
-                        home_team = game['home_team']
-                        away_team = game['away_team']
-                        actual_score = f"{game['actual_home_goals']}-{game['actual_away_goals']}"
-                        predicted_score = f"{game['predicted_home_goals']}-{game['predicted_away_goals']}"
-                        points = game['points']
-                        response += f"    {home_team} vs {away_team}: Predicted {predicted_score}, Actual {actual_score}, Points: {points}\n"
-            await interaction.response.send_message(response, ephemeral=False)
-
-            for item in self.children:
-                item.disabled = True
-            if self.message:
-                await self.message.edit(view=self)  # Edit the original UI message
-                await self.message.delete()
-        else:
-            await interaction.response.send_message("Please set both begin and end dates before getting the history.", ephemeral=True)
+        # The picker is done, remove it
+        self.stop()
+        try:
+            await self.interaction.delete_original_response()
+        except discord.HTTPException:
+            pass
 
 async def register_history_command(interaction: discord.Interaction, bot: commands.Bot):
     user_id = str(interaction.user.id)
 
     view = DateSelectionView(interaction, user_id, bot)
-    
-    # Send the initial message to acknowledge the interaction
     await interaction.response.send_message(
-        "Click the buttons below to set your dates and get your history.",
-        ephemeral=True  # Make this response ephemeral
-    )
-    
-    # Send the actual message with the buttons and store it in `view.message`
-    view.message = await interaction.followup.send(
-        "Click the buttons below to set your dates and get your history.",
+        "Select the period of your history, or enter your own dates.",
         view=view,
         ephemeral=True
     )
@@ -1,20 +1,70 @@
 # keep_alive.py
 
-from flask import Flask
-from threading import Thread
+# A small aiohttp server on the bot's own event loop, started from setup_hook and
+# stopped when the bot closes
 import os
+import time
+from datetime import datetime, timedelta
+import pytz
+from aiohttp import web
+import football_api
+import scheduler
+from metrics import render_metrics
 
-app = Flask('')
+# The scheduler polls at least every MAX_SLEEP, anything older than this means it is stuck
+READY_MAX_AGE = scheduler.MAX_SLEEP + timedelta(minutes=15)
 
-@app.route('/')
-def home():
-    return "I'm alive!"
+runner = None
 
-def run():
+def readiness(bot):
+    now = datetime.utcnow().replace(tzinfo=pytz.utc)
+    fixtures = football_api.feed_cache.get(())
+    poll_age = (now - scheduler.last_successful_poll).total_seconds() if scheduler.last_successful_poll else None
+    cache_age = time.monotonic() - fixtures['fetched_at'] if fixtures else None
+    checks = {
+        'gateway': bot.is_ready() and not bot.is_closed(),
+        'poll': poll_age is not None and poll_age <= READY_MAX_AGE.total_seconds(),
+        'fixtures': cache_age is not None and cache_age <= READY_MAX_AGE.total_seconds()
+    }
+    return {
+        'ready': all(checks.values()),
+        'checks': checks,
+        'last_poll_seconds_ago': poll_age,
+        'fixtures_age_seconds': cache_age,
+        'gateway_latency_ms': round(bot.latency * 1000, 1) if bot.is_ready() else None
+    }
+
+def create_app(bot):
+    async def home(request):
+        return web.Response(text="I'm alive!")
+
+    async def ready(request):
+        status = readiness(bot)
+        return web.json_response(status, status=200 if status['ready'] else 503)
+
+    async def metrics(request):
+        # Prometheus text exposition format
+        return web.Response(body=render_metrics().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/', home)
+    app.router.add_get('/healthz', home)
+    app.router.add_get('/ready', ready)
+    app.router.add_get('/metrics', metrics)
+    return app
+
+async def start_web_server(bot):
+    global runner
+    if runner is not None:
+        return
     # Bind to the port that Render assigns or use port 8080 as default
     port = int(os.environ.get("PORT", 8080))
-    app.run(host='0.0.0.0', port=port)
+    runner = web.AppRunner(create_app(bot), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host='0.0.0.0', port=port).start()
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+async def stop_web_server():
+    global runner
+    if runner is not None:
+        await runner.cleanup()
+        runner = None
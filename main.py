@@ -1,116 +1,121 @@
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import app_commands
 import os
 from commands import register_commands, register_leaderboard_command, register_uclhelp_command
-from predict_commands import register_predict_command
+from predict_commands import register_predict_command, register_predict_components
 from history_commands import register_history_command
-from game_updates import check_game_updates
-from firestore_db import init_firestore, get_users_without_predictions, enable_reminder, disable_reminder, check_reminder_messages
-from football_api import get_next_matchday_matches, convert_to_belgian_time
+from scheduler import start_scheduler, restore_snapshot
+from storage import init_storage
+from async_db import enable_reminder, disable_reminder, flush_user_writes, start_loop_monitor, start_user_flush
+from football_api import close_session
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from pytz import utc
-from keep_alive import keep_alive
+from keep_alive import start_web_server, stop_web_server
+from metrics import timed
+from startup import startup_step, record_ready, sync_commands
+from prediction_lock import start_lock_refresh
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
-# Initialize Firestore
-init_firestore()
+# Initialize the storage backend (Firestore or SQLite)
+with startup_step('storage_init'):
+    init_storage()
+# Serve fixtures and the leaderboard from the local snapshot until the first poll
+with startup_step('snapshot_restore'):
+    restore_snapshot()
 
-# Set up intents
+# Set up intents: everything goes through interactions, so the bot does not need to receive
+# messages at all, let alone their content
 intents = discord.Intents.default()
-intents.message_content = True  # Adjust based on your bot's needs
+intents.messages = False
+
+class PredictionBot(commands.Bot):
+    async def setup_hook(self):
+        # Runs once per process, after login and before the gateway connects; on_ready
+        # fires again on every reconnect
+        with startup_step('web_server'):
+            # The health server runs on the bot's event loop
+            await start_web_server(self)
+        register_predict_components(self)
+        start_loop_monitor()
+        start_user_flush()
+        start_lock_refresh()
+        with startup_step('command_sync'):
+            # Commands are only uploaded when their definitions changed
+            synced = await sync_commands(self.tree, self.application_id)
+        print("Slash commands synced." if synced else "Slash commands unchanged, sync skipped.")
+        start_scheduler(self)
+
+    async def close(self):
+        # bot.run calls this on shutdown, so queued user changes are not lost on a restart
+        await stop_web_server()
+        try:
+            await flush_user_writes()
+        except Exception as e:
+            print(f"An error occurred while flushing user writes: {e}")
+        await close_session()
+        await super().close()
 
 # Initialize the bot
-bot = commands.Bot(command_prefix="command is", intents=intents)
+# Without message events there is nothing to keep in the message cache
+bot = PredictionBot(command_prefix="command is", intents=intents, max_messages=None)
 tree = bot.tree  # This handles slash commands
 
-# Task to check for game updates regularly
-@tasks.loop(minutes=5)
-async def update_game_results():
-    await check_game_updates(bot)
-
-# Task to send reminders for games that are between 23 and 24 hours away
-@tasks.loop(hours=1)
-async def send_prediction_reminders():
-    print('running loop')
-    now = datetime.utcnow().replace(tzinfo=utc)
-    next_matchday_matches, ongoing_matches = get_next_matchday_matches()
-
-    for match in next_matchday_matches:
-        match_time = convert_to_belgian_time(match['utcDate'])
-        time_difference = match_time - now
-
-        # Check if the match is between 23 and 24 hours away
-        if timedelta(hours=23) <= time_difference <= timedelta(hours=24):
-            match_id = str(match['id'])
-            home_team = match['homeTeam']['name']
-            away_team = match['awayTeam']['name']
-
-            # Get users without predictions for this match
-            users_without_predictions = get_users_without_predictions(match_id)
-
-            # Send reminder message to each user
-            for user_id in users_without_predictions:
-                send_reminder = check_reminder_messages(user_id)
-                if send_reminder:
-                    user = await bot.fetch_user(int(user_id))
-                    await user.send(
-                        f"Reminder: The match between {home_team} and {away_team} is in less than 24 hours. "
-                        "Please make sure to submit your prediction!"
-                    )
-
-# Start checking game updates when bot is ready
 @bot.event
 async def on_ready():
-    print(f'{bot.user} has connected to Discord!')
-    await tree.sync()  # Sync slash commands with Discord
-    update_game_results.start()
-    send_prediction_reminders.start()
+    if record_ready() == 1:
+        print(f'{bot.user} has connected to Discord!')
+    else:
+        print(f'{bot.user} has reconnected to Discord.')
 
 # Define slash commands using app_commands.command decorator
 @tree.command(name="predict", description="Predict the Champions League match results.")
+@timed('command', 'predict')
 async def predict(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    enable_reminder(user_id)
+    await enable_reminder(user_id)
     await register_predict_command(interaction, bot)
 
 @tree.command(name="history", description="Interactively select a date range to view your past predictions.")
+@timed('command', 'history')
 async def history(interaction: discord.Interaction):
     await register_history_command(interaction, bot)
 
 @tree.command(name="leaderboard", description="View the current leaderboard.")
+@timed('command', 'leaderboard')
 async def leaderboard(interaction: discord.Interaction):
     await register_leaderboard_command(interaction, bot)
 
 @tree.command(name="help", description="Show available commands.")
+@timed('command', 'help')
 async def uclhelp(interaction: discord.Interaction):
     await register_uclhelp_command(interaction, bot)
 
 @tree.command(name="enable_messages", description="Enable reminder messages for the prediction.")
+@timed('command', 'enable_messages')
 async def enable_discord_reminder(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    enable_reminder(user_id)
+    await enable_reminder(user_id)
     message = "The bot is now enabled to send reminder messages."
     await interaction.response.send_message(message, ephemeral=True)
 
 @tree.command(name="disable_messages", description="Disable reminder messages for the prediction.")
+@timed('command', 'disable_messages')
 async def disable_discord_reminder(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    disable_reminder(user_id)
+    await disable_reminder(user_id)
     message = "The bot is now disabled to send reminder messages."
     await interaction.response.send_message(message, ephemeral=True)
 
 @tree.command(name="register", description="Register to be part of the prediction game.")
+@timed('command', 'register')
 async def register(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    enable_reminder(user_id)
+    await enable_reminder(user_id)
     message = "You are now registered in the UCL prediction game. Your reminder messages are currently enabled."
     await interaction.response.send_message(message, ephemeral=True)
 
 # Run the bot
-keep_alive()
 bot.run(TOKEN)
@@ -0,0 +1,140 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import defaultdict
+
+# Latency histograms per kind of work ('command', 'task', 'storage'), exposed in the
+# Prometheus text format on /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# (kind, name) -> {'buckets': [count per bucket], 'count': int, 'sum': float, 'errors': int}
+latencies = {}
+# Firestore documents read and written per storage operation: (kind, operation) -> count
+firestore_ops = defaultdict(int)
+metrics_lock = threading.Lock()
+# The storage operation running on the current thread, used to attribute Firestore traffic
+current = threading.local()
+
+def observe(kind, name, seconds, failed=False):
+    with metrics_lock:
+        histogram = latencies.get((kind, name))
+        if histogram is None:
+            histogram = latencies[(kind, name)] = {'buckets': [0] * len(LATENCY_BUCKETS), 'count': 0, 'sum': 0.0, 'errors': 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+        if failed:
+            histogram['errors'] += 1
+
+def timed(kind, name=None):
+    # Records the latency of a sync or async function; sync functions also become the
+    # operation that Firestore reads and writes on their thread are counted against
+    def decorator(func):
+        label = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                failed = True
+                try:
+                    result = await func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    observe(kind, label, time.perf_counter() - start, failed)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = getattr(current, 'operation', None)
+            # Nested storage calls are counted against the outermost operation
+            current.operation = outer or label
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                current.operation = outer
+                observe(kind, label, time.perf_counter() - start, failed)
+        return wrapper
+    return decorator
+
+def record_firestore(kind, count):
+    operation = getattr(current, 'operation', None) or 'unattributed'
+    with metrics_lock:
+        firestore_ops[(kind, operation)] += count
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + '}'
+
+def render_metric(lines, name, metric_type, help_text, samples):
+    # samples is a list of (labels, value)
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {metric_type}')
+    for labels, value in samples:
+        lines.append(f'{name}{format_labels(labels)} {value}')
+
+def render_metrics():
+    # Imported here so that every module can use the decorators without import cycles
+    import async_db
+    import football_api
+    import reminders
+    import startup
+    import user_cache
+
+    with metrics_lock:
+        histograms = {key: dict(histogram, buckets=list(histogram['buckets'])) for key, histogram in latencies.items()}
+        operations = dict(firestore_ops)
+
+    lines = []
+    for kind in ('command', 'task', 'storage'):
+        name = f'ucl_{kind}_duration_seconds'
+        lines.append(f'# HELP {name} Latency of {kind} calls.')
+        lines.append(f'# TYPE {name} histogram')
+        errors = []
+        for (histogram_kind, label), histogram in sorted(histograms.items()):
+            if histogram_kind != kind:
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                lines.append(f'{name}_bucket{format_labels({kind: label, "le": bound})} {count}')
+            lines.append(f'{name}_bucket{format_labels({kind: label, "le": "+Inf"})} {histogram["count"]}')
+            lines.append(f'{name}_sum{format_labels({kind: label})} {histogram["sum"]:.6f}')
+            lines.append(f'{name}_count{format_labels({kind: label})} {histogram["count"]}')
+            errors.append(({kind: label}, histogram['errors']))
+        render_metric(lines, f'ucl_{kind}_errors_total', 'counter', f'Failed {kind} calls.', errors)
+
+    for kind in ('read', 'write'):
+        render_metric(lines, f'ucl_firestore_{kind}s_total', 'counter', f'Firestore documents {kind} per storage operation.',
+                      [({'operation': operation}, count) for (op_kind, operation), count in sorted(operations.items()) if op_kind == kind])
+
+    feed_stats = football_api.get_feed_stats()
+    render_metric(lines, 'ucl_football_requests_total', 'counter', 'Requests sent to football-data.org.', [({}, feed_stats['requests'])])
+    render_metric(lines, 'ucl_football_lookups_total', 'counter', 'Feed lookups and responses by outcome.',
+                  [({'result': result}, feed_stats[result]) for result in ('hits', 'misses', 'not_modified', 'rate_limited')])
+    render_metric(lines, 'ucl_football_budget_remaining', 'gauge', 'Requests left in the current rate limit window.', [({}, feed_stats['remaining_budget'])])
+    render_metric(lines, 'ucl_football_cached_entries', 'gauge', 'Feed responses held in the cache.', [({}, feed_stats['cached_entries'])])
+
+    render_metric(lines, 'ucl_event_loop_lag_seconds', 'gauge', 'Event loop lag of the last sample and the maximum seen.',
+                  [({'sample': 'last'}, f"{async_db.loop_lag['last']:.6f}"), ({'sample': 'max'}, f"{async_db.loop_lag['max']:.6f}")])
+    render_metric(lines, 'ucl_event_loop_blocked_total', 'counter', 'Loop lag samples above the threshold.', [({}, async_db.loop_lag['over_threshold'])])
+
+    dispatch_stats = reminders.get_dispatch_stats()
+    render_metric(lines, 'ucl_reminder_dms_total', 'counter', 'Reminder digests by outcome.',
+                  [({'result': result}, dispatch_stats[result]) for result in ('sent', 'forbidden', 'failed', 'already_sent')])
+
+    render_metric(lines, 'ucl_name_cache_total', 'counter', 'Display name lookups by source.',
+                  [({'source': source}, count) for source, count in sorted(user_cache.name_stats.items())])
+
+    render_metric(lines, 'ucl_startup_seconds', 'gauge', 'Duration of each startup step.',
+                  [({'step': step}, f'{seconds:.6f}') for step, seconds in startup.startup_timings.items()])
+    render_metric(lines, 'ucl_gateway_ready_total', 'counter', 'on_ready events, including reconnects.', [({}, startup.ready_count)])
+    return '\n'.join(lines) + '\n'
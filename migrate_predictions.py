@@ -0,0 +1,121 @@
+# migrate_predictions.py
+# One-off migration of auto-ID predictions to the '{match_id}_{user_id}' layout.
+# Duplicate predictions for the same user and match are collapsed into one document,
+# and points of duplicates that were settled more than once are taken back.
+#
+# Usage: python migrate_predictions.py [--apply]
+
+import argparse
+from collections import defaultdict
+from firebase_admin import firestore
+import firestore_db
+from firestore_db import init_firestore, get_settled_game_ids, get_user_refs, mark_leaderboard_dirty, prediction_doc_id, BATCH_LIMIT
+
+def is_settled(doc, finished_ids):
+    return bool(doc.get('settled')) or doc.get('match_id') in finished_ids
+
+def pick_prediction(docs, finished_ids):
+    # Prefer a settled prediction so the stored points stay consistent with the user's total,
+    # then one that already has the new ID
+    return max(docs, key=lambda doc: (is_settled(doc, finished_ids), doc.id == prediction_doc_id(doc.get('match_id'), doc.get('user_id'))))
+
+def plan_migration(finished_ids):
+    # Returns the predictions grouped per (match_id, user_id) and, for every group that needs
+    # changes, (user_id, move or None, documents to delete, points to take back)
+    groups = defaultdict(list)
+    for prediction in firestore_db.db.collection('predictions').stream():
+        groups[(prediction.get('match_id'), prediction.get('user_id'))].append(prediction)
+
+    migrations = []
+    for (match_id, user_id), docs in groups.items():
+        target_id = prediction_doc_id(match_id, user_id)
+        kept = pick_prediction(docs, finished_ids)
+        move = None
+        deletes = []
+        correction = 0
+        for doc in docs:
+            if doc is kept:
+                continue
+            # A document already at the target ID is overwritten by the move instead
+            if doc.id != target_id:
+                deletes.append(doc)
+            # Every settled duplicate added its points to the user once too often
+            if is_settled(doc, finished_ids):
+                correction -= doc.to_dict().get('points', 0)
+        if kept.id != target_id:
+            move = (kept, target_id)
+            deletes.append(kept)
+        if move or deletes or correction:
+            migrations.append((user_id, move, deletes, correction))
+    return groups, migrations
+
+def migration_writes(migration, user_refs):
+    user_id, move, deletes, correction = migration
+    writes = []
+    if move:
+        kept, target_id = move
+        writes.append(('set', firestore_db.db.collection('predictions').document(target_id), kept.to_dict()))
+    writes += [('delete', doc.reference, None) for doc in deletes]
+    if correction and user_id in user_refs:
+        writes.append(('increment', user_refs[user_id], correction))
+    return writes
+
+def apply_migration(migrations):
+    # The move, deletes and point correction of one user and match are always committed in
+    # the same batch, so a run that fails halfway can simply be started again
+    user_refs = get_user_refs()
+    if any(correction for _, _, _, correction in migrations):
+        mark_leaderboard_dirty()
+
+    batch = firestore_db.db.batch()
+    batch_size = 0
+    for migration in migrations:
+        writes = migration_writes(migration, user_refs)
+        if batch_size + len(writes) > BATCH_LIMIT:
+            batch.commit()
+            batch = firestore_db.db.batch()
+            batch_size = 0
+        for kind, ref, data in writes:
+            if kind == 'set':
+                batch.set(ref, data)
+            elif kind == 'delete':
+                batch.delete(ref)
+            else:
+                batch.update(ref, {'points': firestore.Increment(data)})
+        batch_size += len(writes)
+    if batch_size:
+        batch.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate predictions to deterministic document IDs.")
+    parser.add_argument('--apply', action='store_true', help="write the changes instead of only reporting them")
+    args = parser.parse_args()
+
+    init_firestore()
+    finished_ids = set(get_settled_game_ids())
+    groups, migrations = plan_migration(finished_ids)
+    moves = [move for _, move, _, _ in migrations if move]
+    deletes = [doc for _, _, docs, _ in migrations for doc in docs]
+    point_corrections = defaultdict(int)
+    for user_id, _, _, correction in migrations:
+        point_corrections[user_id] += correction
+
+    duplicates = {key: docs for key, docs in groups.items() if len(docs) > 1}
+    print(f"{sum(len(docs) for docs in groups.values())} predictions for {len(groups)} user/match pairs")
+    print(f"{len(moves)} predictions to move to a deterministic ID, {len(deletes)} documents to delete")
+    print(f"{len(duplicates)} user/match pairs with duplicates:")
+    for (match_id, user_id), docs in duplicates.items():
+        scores = ', '.join(f"{doc.id}: {doc.get('home_goals')}-{doc.get('away_goals')}" for doc in docs)
+        print(f"  match {match_id}, user {user_id}: {scores}")
+    for user_id, points in point_corrections.items():
+        if points:
+            print(f"  user {user_id}: {points} points for duplicates settled twice")
+
+    if args.apply:
+        apply_migration(migrations)
+        print("Migration applied.")
+    else:
+        print("Dry run, nothing was written. Use --apply to migrate.")
+
+if __name__ == '__main__':
+    main()
@@ -1,112 +1,254 @@
+import asyncio
+import re
+import zlib
 import discord
-from discord.ui import View, Button, Select
-from firestore_db import save_prediction, get_predictions_user_match
-from football_api import get_next_matchday_matches, convert_to_belgian_time
-
-class MatchSelectView(View):
-    def __init__(self, ctx, user_id, bot, matches):
-        super().__init__()
-        self.ctx = ctx
-        self.user_id = user_id
-        self.bot = bot
-        self.matches = matches
-        self.selected_match_id = None
-        self.message = None  # To store the original message
-
-        options = [discord.SelectOption(label=f"{match['homeTeam']['name']} vs {match['awayTeam']['name']}", value=str(match['id'])) for match in matches]
-        id_to_home_team = {str(match['id']): match['homeTeam']['name'] for match in matches}
-        id_to_away_team = {str(match['id']): match['awayTeam']['name'] for match in matches}
-        if len(self.matches) > 0:
-            self.add_item(SelectMatch(options, user_id, id_to_home_team, id_to_away_team))
-
-class SelectMatch(Select):
-    def __init__(self, options, user_id, id_to_home_team, id_to_away_team):
-        super().__init__(placeholder="Select a match...", options=options)
-        self.user_id = user_id
-        self.id_to_home_team = id_to_home_team
-        self.id_to_away_team = id_to_away_team
+from discord.ui import View, Select, Button, Modal, TextInput, DynamicItem
+from async_db import save_prediction, save_predictions, get_predictions_user_matches
+from db_utils import PredictionLocked
+from prediction_lock import is_open
+from football_api import get_next_matchday_matches, get_fixture_index
+
+# Defer the response when building the overview takes longer than this (Discord allows 3 seconds)
+DEFER_AFTER = 2.0
+
+# The prediction flow keeps no state on the bot: the match and the home goals travel in the
+# custom_id of each select, and the items are routed by their custom_id template, so a flow
+# started before a restart can still be finished after it
+GOAL_OPTIONS = [discord.SelectOption(label=str(goals), value=str(goals)) for goals in range(20)]
+# Bulk entry: a modal holds at most 5 inputs, and the scores entered on earlier pages travel
+# in the custom_id of the "next page" button, two characters per match, by position in
+# the matchday; a checksum of the match order makes sure the positions still mean the same
+BULK_PAGE_SIZE = 5
+GOAL_CHARS = '0123456789abcdefghij'
+SCORE_PATTERN = re.compile(r'^\s*(\d{1,2})\s*[-:]\s*(\d{1,2})\s*$')
+# Match options per matchday, shared by every /predict of that matchday
+match_option_cache = {}
+
+def match_options(matches):
+    key = tuple(match.id for match in matches)
+    if key not in match_option_cache:
+        if len(match_option_cache) > 32:
+            match_option_cache.clear()
+        match_option_cache[key] = [discord.SelectOption(label=f"{match.home_team} vs {match.away_team}", value=match.id) for match in matches]
+    return match_option_cache[key]
+
+async def get_teams(match_id):
+    match = (await get_fixture_index()).by_id.get(match_id)
+    return (match.home_team, match.away_team) if match else ("Home", "Away")
+
+def single_item_view(*items):
+    # A view of dynamic items only is not stored by discord.py, it is just what gets sent
+    view = View(timeout=None)
+    for item in items:
+        view.add_item(item)
+    return view
+
+class MatchSelect(DynamicItem[Select], template=r'predict:match'):
+    def __init__(self, options):
+        super().__init__(Select(placeholder="Select a match...", options=options, custom_id='predict:match'))
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(item.options)
 
     async def callback(self, interaction: discord.Interaction):
-        selected_match_id = self.values[0]
+        match_id = self.item.values[0]
+        home_team, away_team = await get_teams(match_id)
+        if not is_open(match_id):
+            await interaction.response.edit_message(content=f"{home_team} vs {away_team} has already started, predictions are closed.", view=None)
+            return
         # Prompt for home goals
-        view = HomeGoalsSelectView(interaction.channel, self.user_id, selected_match_id, self.id_to_home_team, self.id_to_away_team)
         await interaction.response.edit_message(
-            content=f"Match **{self.id_to_home_team[selected_match_id]} vs {self.id_to_away_team[selected_match_id]}** selected. Please select {self.id_to_home_team[selected_match_id]}'s goals.",
-            view=view
+            content=f"Match **{home_team} vs {away_team}** selected. Please select {home_team}'s goals.",
+            view=single_item_view(HomeGoalsSelect(match_id, home_team))
         )
 
-class HomeGoalsSelectView(View):
-    def __init__(self, channel, user_id, match_id, id_to_home_team, id_to_away_team):
-        super().__init__()
-        self.channel = channel
-        self.user_id = user_id
+class HomeGoalsSelect(DynamicItem[Select], template=r'predict:home:(?P<match_id>\d+)'):
+    def __init__(self, match_id, placeholder):
+        super().__init__(Select(placeholder=placeholder, options=GOAL_OPTIONS, custom_id=f'predict:home:{match_id}'))
         self.match_id = match_id
-        self.id_to_home_team = id_to_home_team
-        self.id_to_away_team = id_to_away_team
-        self.home_goals = None
 
-        self.add_item(SelectGoals(f"{self.id_to_home_team[match_id]}", [str(i) for i in range(20)], self))
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match['match_id'], item.placeholder)
 
-class AwayGoalsSelectView(View):
-    def __init__(self, channel, user_id, match_id, home_goals, id_to_home_team, id_to_away_team):
-        super().__init__()
-        self.channel = channel
-        self.user_id = user_id
+    async def callback(self, interaction: discord.Interaction):
+        home_goals = self.item.values[0]
+        home_team, away_team = await get_teams(self.match_id)
+        # Move to selecting away goals
+        await interaction.response.edit_message(
+            content=f"{home_team} goals set to {home_goals}. Now select the {away_team}'s goals.",
+            view=single_item_view(AwayGoalsSelect(self.match_id, home_goals, away_team))
+        )
+
+class AwayGoalsSelect(DynamicItem[Select], template=r'predict:away:(?P<match_id>\d+):(?P<home_goals>\d+)'):
+    def __init__(self, match_id, home_goals, placeholder):
+        super().__init__(Select(placeholder=placeholder, options=GOAL_OPTIONS, custom_id=f'predict:away:{match_id}:{home_goals}'))
         self.match_id = match_id
-        self.id_to_home_team = id_to_home_team
-        self.id_to_away_team = id_to_away_team
         self.home_goals = home_goals
 
-        self.add_item(SelectGoals(f"{self.id_to_away_team[match_id]}", [str(i) for i in range(20)], self))
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match['match_id'], match['home_goals'], item.placeholder)
+
+    async def callback(self, interaction: discord.Interaction):
+        away_goals = self.item.values[0]
+        home_team, away_team = await get_teams(self.match_id)
+        # Save the prediction
+        try:
+            await save_prediction(str(interaction.user.id), self.match_id, int(self.home_goals), int(away_goals))
+        except PredictionLocked:
+            await interaction.response.edit_message(content=f"{home_team} vs {away_team} has already started, predictions are closed.", view=None)
+            return
+        await interaction.response.edit_message(
+            content=f"Prediction saved: {home_team} {self.home_goals} - {away_goals} {away_team}.",
+            view=None
+        )
+
+def decode_scores(scores, count):
+    # Returns a list with (home_goals, away_goals) or None per match of the matchday
+    scores = scores.ljust(count * 2, '.')
+    return [(GOAL_CHARS.index(scores[i * 2]), GOAL_CHARS.index(scores[i * 2 + 1])) if scores[i * 2] != '.' else None for i in range(count)]
+
+def encode_scores(scores):
+    return ''.join(GOAL_CHARS[score[0]] + GOAL_CHARS[score[1]] if score else '..' for score in scores).rstrip('.')
+
+def match_order(matches):
+    # Changes when a rescheduled kickoff reorders the matchday
+    return f"{zlib.crc32(','.join(match.id for match in matches).encode()):08x}"
+
+async def get_bulk_page(anchor, position):
+    # The matchday is identified by one of its matches; returns (matchday matches, positions
+    # of the open matches on the next page, order checksum)
+    index = await get_fixture_index()
+    if anchor not in index.by_id:
+        return [], [], ''
+    matches = index.by_matchday[index.by_id[anchor].matchday_key]
+    positions = [i for i, match in enumerate(matches) if i > position and is_open(match.id)]
+    return matches, positions[:BULK_PAGE_SIZE], match_order(matches)
+
+async def reject_reordered(interaction):
+    await interaction.response.edit_message(content="The schedule of this matchday changed while you were entering scores, nothing was saved. Please start again with /predict.", view=None)
 
-class SelectGoals(Select):
-    def __init__(self, placeholder, options, parent_view):
-        super().__init__(placeholder=placeholder, options=[discord.SelectOption(label=option, value=option) for option in options])
-        self.parent_view = parent_view
+class BulkPredictButton(DynamicItem[Button], template=r'predict:bulk:(?P<anchor>\d+):(?P<order>[0-9a-f]{8})?:(?P<position>-?\d+):(?P<scores>[0-9a-j.]*)'):
+    def __init__(self, anchor, order='', position=-1, scores='', label="Predict all matches"):
+        super().__init__(Button(label=label, style=discord.ButtonStyle.green, custom_id=f'predict:bulk:{anchor}:{order}:{position}:{scores}'))
+        self.anchor = anchor
+        # Empty on the first page, where no scores were entered yet
+        self.order = order
+        self.position = position
+        self.scores = scores
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match['anchor'], match['order'] or '', int(match['position']), match['scores'], item.label)
 
     async def callback(self, interaction: discord.Interaction):
-        if self.placeholder == f"{self.parent_view.id_to_home_team[self.parent_view.match_id]}":
-            home_goals = self.values[0]
-            # Move to selecting away goals
-            view = AwayGoalsSelectView(interaction.channel, self.parent_view.user_id, self.parent_view.match_id, home_goals, self.parent_view.id_to_home_team, self.parent_view.id_to_away_team)
-            await interaction.response.edit_message(
-                content=f"{self.parent_view.id_to_home_team[self.parent_view.match_id]} goals set to {home_goals}. Now select the {self.parent_view.id_to_away_team[self.parent_view.match_id]}'s goals.",
-                view=view
-            )
-
-        elif self.placeholder == f"{self.parent_view.id_to_away_team[self.parent_view.match_id]}":
-            away_goals = self.values[0]
-            home_goals = self.parent_view.home_goals
-            match_id = self.parent_view.match_id
-            # Save the prediction
-            save_prediction(self.parent_view.user_id, match_id, int(home_goals), int(away_goals))
-            await interaction.response.edit_message(
-                content=f"Prediction saved: {self.parent_view.id_to_home_team[self.parent_view.match_id]} {home_goals} - {away_goals} {self.parent_view.id_to_away_team[self.parent_view.match_id]}.",
-                view=None
-            )
-
-def show_upcoming_matches(next_matchday_matches, user_id):
+        matches, positions, order = await get_bulk_page(self.anchor, self.position)
+        if self.order and order != self.order:
+            await reject_reordered(interaction)
+            return
+        if not positions:
+            await finish_bulk_entry(interaction, matches, decode_scores(self.scores, len(matches)))
+            return
+        # Prefill with what was entered on this page before, or with the stored predictions
+        scores = decode_scores(self.scores, len(matches))
+        stored = await get_predictions_user_matches(str(interaction.user.id), [matches[i].id for i in positions])
+        defaults = {}
+        for i in positions:
+            if scores[i]:
+                defaults[i] = f"{scores[i][0]}-{scores[i][1]}"
+            elif stored[matches[i].id]:
+                defaults[i] = f"{stored[matches[i].id]['home_goals']}-{stored[matches[i].id]['away_goals']}"
+        await interaction.response.send_modal(BulkPredictionModal(self.anchor, order, matches, positions, scores, defaults))
+
+class BulkPredictionModal(Modal):
+    def __init__(self, anchor, order, matches, positions, scores, defaults):
+        super().__init__(title="Predict the matchday", timeout=600)
+        self.anchor = anchor
+        self.order = order
+        self.matches = matches
+        self.positions = positions
+        self.scores = scores
+        self.inputs = []
+        for i in positions:
+            score_input = TextInput(label=f"{matches[i].home_team} - {matches[i].away_team}"[:45], placeholder="2-1",
+                                    default=defaults.get(i), required=False, max_length=7)
+            self.add_item(score_input)
+            self.inputs.append((i, score_input))
+
+    async def on_submit(self, interaction: discord.Interaction):
+        scores = list(self.scores)
+        for i, score_input in self.inputs:
+            if not score_input.value.strip():
+                continue
+            score = SCORE_PATTERN.match(score_input.value)
+            if not score or int(score.group(1)) >= len(GOAL_CHARS) or int(score.group(2)) >= len(GOAL_CHARS):
+                await interaction.response.send_message(f"Invalid score '{score_input.value}' for {self.matches[i].home_team} - {self.matches[i].away_team}. Please use a score like 2-1.", ephemeral=True)
+                return
+            scores[i] = (int(score.group(1)), int(score.group(2)))
+
+        last_position = self.positions[-1]
+        _, next_positions, order = await get_bulk_page(self.anchor, last_position)
+        if order != self.order:
+            await reject_reordered(interaction)
+            return
+        if not next_positions:
+            await finish_bulk_entry(interaction, self.matches, scores)
+            return
+        entered = sum(1 for score in scores if score)
+        await interaction.response.edit_message(
+            content=f"{entered} scores entered so far, {len(next_positions)} more matches on the next page. Nothing is saved until the last page.",
+            view=single_item_view(BulkPredictButton(self.anchor, self.order, last_position, encode_scores(scores), "Next matches"))
+        )
+
+async def finish_bulk_entry(interaction, matches, scores):
+    # All pages are in: save every score in one batched write and echo them in one message
+    predictions = {match.id: score for match, score in zip(matches, scores) if score and is_open(match.id)}
+    if not predictions:
+        await interaction.response.edit_message(content="No predictions were entered for matches that are still open.", view=None)
+        return
+    try:
+        await save_predictions(str(interaction.user.id), predictions)
+    except PredictionLocked as e:
+        # A match kicked off while the last page was open
+        await interaction.response.edit_message(content=f"{len(e.match_ids)} of the matches started in the meantime, nothing was saved. Please try again.", view=None)
+        return
+    message = f"{len(predictions)} predictions saved:\n"
+    for match in matches:
+        if match.id in predictions:
+            home_goals, away_goals = predictions[match.id]
+            message += f"{match.local_kickoff.strftime('%d/%m %H:%M')}: {match.home_team} **{home_goals}-{away_goals}** {match.away_team}\n"
+    await interaction.response.edit_message(content=message, view=None)
+
+def register_predict_components(bot):
+    # Called once at startup, the items then handle every prediction message, old or new
+    bot.add_dynamic_items(MatchSelect, HomeGoalsSelect, AwayGoalsSelect, BulkPredictButton)
+
+async def show_upcoming_matches(next_matchday_matches, user_id):
     response = "Upcoming Champions League Matches:\n"
     current_date = None
 
+    # Read the user's predictions for all listed matches at once
+    predictions = await get_predictions_user_matches(user_id, [match.id for match in next_matchday_matches])
+
     for match in next_matchday_matches:
-        match_id = str(match['id'])
-        prediction = get_predictions_user_match(user_id=user_id, match_id=match_id)
-        match_date = convert_to_belgian_time(match['utcDate']).strftime("%Y-%m-%d")
-        match_time = convert_to_belgian_time(match['utcDate']).strftime("%H:%M")
-        home_team = match['homeTeam']['name']
-        away_team = match['awayTeam']['name']
+        prediction = predictions[match.id]
+        match_date = match.local_kickoff.strftime("%Y-%m-%d")
+        match_time = match.local_kickoff.strftime("%H:%M")
+        home_team = match.home_team
+        away_team = match.away_team
         home_score = 0
         away_score = 0
-        if match['status'] == 'IN_PLAY' or match['status'] == 'PAUSED':
-            home_score = match['score']['fullTime']['home']
-            away_score = match['score']['fullTime']['away']
+        if match.is_live:
+            home_score = match.home_score
+            away_score = match.away_score
 
 
         if match_date != current_date:
             current_date = match_date
             response += f"\n{match_date}:\n"
-        if match['status'] == 'IN_PLAY' or match['status'] == 'PAUSED':
+        if match.is_live:
             if prediction is None:
                 response += f"{match_time}: {home_team}     _-_  ({home_score}-{away_score})    {away_team}\n"
             else:
@@ -119,19 +261,38 @@ def show_upcoming_matches(next_matchday_matches, user_id):
 
     return response
 
+async def build_match_overview(user_id):
+    next_matchday_matches, ongoing_matches = await get_next_matchday_matches()
+    if not next_matchday_matches and not ongoing_matches:
+        return next_matchday_matches, None
+    return next_matchday_matches, await show_upcoming_matches(ongoing_matches, user_id)
+
 async def register_predict_command(ctx,bot):
     user_id = str(ctx.user.id)
-    next_matchday_matches, ongoing_matches = get_next_matchday_matches()
-    if not next_matchday_matches and not ongoing_matches:
-        await ctx.response.send_message("No upcoming or ongoing matches found.")
+
+    # Acknowledge the interaction first when the overview is slow to build
+    overview = asyncio.ensure_future(build_match_overview(user_id))
+    done, _ = await asyncio.wait({overview}, timeout=DEFER_AFTER)
+    deferred = not done
+    if deferred:
+        await ctx.response.defer(ephemeral=True, thinking=True)
+    next_matchday_matches, matches_message = await overview
+
+    if matches_message is None:
+        if deferred:
+            await ctx.followup.send("No upcoming or ongoing matches found.")
+        else:
+            await ctx.response.send_message("No upcoming or ongoing matches found.")
         return
-    matches_message = show_upcoming_matches(ongoing_matches, user_id)
-    # print('next_matchday_matches',next_matchday_matches )
-    # print('ongoing_matches',ongoing_matches)
-    # Send the message with the match list and then add the dropdown
-    view = MatchSelectView(ctx, user_id, bot, next_matchday_matches)
-    view.message = await ctx.response.send_message(matches_message, view=view, ephemeral=True)
+    # Send the message with the match list and the dropdown
+    if next_matchday_matches:
+        view = single_item_view(MatchSelect(match_options(next_matchday_matches)), BulkPredictButton(next_matchday_matches[0].id))
+    else:
+        view = View(timeout=None)
+    if deferred:
+        await ctx.followup.send(matches_message, view=view, ephemeral=True)
+    else:
+        await ctx.response.send_message(matches_message, view=view, ephemeral=True)
     
     # Optionally, you can delete the user's command message if needed
     # await ctx.message.delete()
-
@@ -0,0 +1,64 @@
+# prediction_lock.py
+# Answers "is this match still open for predictions?" from memory. The kickoffs come from
+# the cached fixture index, kept fresh by a background task, and are also handed to the
+# storage backend, which checks them again right before writing.
+
+import asyncio
+import os
+import time
+import football_api
+from fixtures import index_fixtures
+from storage import backend
+from db_utils import PredictionLocked
+
+LOCK_REFRESH_INTERVAL = int(os.getenv('LOCK_REFRESH_INTERVAL', 900))
+
+# match_id -> kickoff as a UNIX timestamp, 0 for matches that are not scheduled any more
+kickoffs = {}
+# The fixture index the kickoffs were taken from
+locked_index = None
+lock_refresh_task = None
+
+def refresh_kickoffs():
+    # Only does work when the feed handed out a new fixture list
+    global kickoffs, locked_index
+    entry = football_api.feed_cache.get(())
+    if entry is None:
+        return
+    index = index_fixtures(entry['matches'])
+    if index is locked_index:
+        return
+    kickoffs = {match.id: match.kickoff.timestamp() if match.is_scheduled else 0.0 for match in index.matches}
+    locked_index = index
+    backend.set_kickoffs(kickoffs)
+
+def is_open(match_id):
+    refresh_kickoffs()
+    # Unknown matches are closed, nothing can be predicted that is not in the fixtures
+    # (see db_utils.check_kickoffs for why the backends treat them differently)
+    return time.time() < kickoffs.get(match_id, 0.0)
+
+def check_open(match_ids):
+    locked = [match_id for match_id in match_ids if not is_open(match_id)]
+    if locked:
+        raise PredictionLocked(locked)
+
+async def ensure_kickoffs():
+    # After a restart without a snapshot, load the fixtures before the first check
+    if locked_index is None:
+        await football_api.get_fixture_index()
+        refresh_kickoffs()
+
+async def refresh_kickoffs_periodically():
+    while True:
+        try:
+            await football_api.get_fixture_index()
+            refresh_kickoffs()
+        except Exception as e:
+            print(f"An error occurred while refreshing the kickoffs: {e}")
+        await asyncio.sleep(LOCK_REFRESH_INTERVAL)
+
+def start_lock_refresh():
+    global lock_refresh_task
+    if lock_refresh_task is None:
+        lock_refresh_task = asyncio.get_running_loop().create_task(refresh_kickoffs_periodically())
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from collections import defaultdict
+import discord
+from async_db import get_reminder_targets, get_reminder_ledger, record_reminders, disable_reminder
+from rate_limit import TokenBucket
+from metrics import timed
+from user_cache import get_discord_user
+
+# A DM costs two API calls (open the DM channel, send), so stay well below Discord's global limit
+DM_CONCURRENCY = 5
+DM_PER_SECOND = 5
+dm_rate_limiter = TokenBucket(DM_PER_SECOND, 1)
+
+dispatch_stats = {'sent': 0, 'failed': 0, 'forbidden': 0, 'already_sent': 0, 'last_run_seconds': 0.0, 'last_run_per_second': 0.0}
+# Send latencies of the last run, in seconds
+dispatch_latencies = []
+
+def format_digest(matches):
+    message = "Reminder: These matches start within the next day and you haven't predicted them yet:\n"
+    for match in sorted(matches, key=lambda match: match.kickoff):
+        message += f"{match.local_kickoff.strftime('%d/%m %H:%M')}: {match.home_team} vs {match.away_team}\n"
+    message += "Please make sure to submit your predictions with /predict!"
+    return message
+
+async def send_digest(bot, user_id, message):
+    await dm_rate_limiter.acquire()
+    start = time.perf_counter()
+    try:
+        user = await get_discord_user(bot, user_id)
+        await user.send(message)
+        dispatch_stats['sent'] += 1
+    except discord.Forbidden:
+        # The user closed their DMs, stop trying to remind them
+        dispatch_stats['forbidden'] += 1
+        await disable_reminder(user_id)
+    except discord.HTTPException as e:
+        dispatch_stats['failed'] += 1
+        print(f"Could not send a reminder to {user_id}: {e}")
+    dispatch_latencies.append(time.perf_counter() - start)
+
+async def dispatch_reminders(bot, digests):
+    queue = asyncio.Queue()
+    for user_id, message in digests.items():
+        queue.put_nowait((user_id, message))
+
+    async def worker():
+        while not queue.empty():
+            user_id, message = queue.get_nowait()
+            await send_digest(bot, user_id, message)
+
+    dispatch_latencies.clear()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(DM_CONCURRENCY, len(digests)))))
+    elapsed = time.perf_counter() - start
+    dispatch_stats['last_run_seconds'] = elapsed
+    dispatch_stats['last_run_per_second'] = len(digests) / elapsed if elapsed else 0.0
+
+def get_dispatch_stats():
+    latencies = sorted(dispatch_latencies)
+    stats = dict(dispatch_stats)
+    if latencies:
+        stats['p50_latency'] = latencies[len(latencies) // 2]
+        stats['p95_latency'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return stats
+
+@timed('task')
+async def send_prediction_reminders(bot, matches):
+    matches = {match.id: match for match in matches}
+
+    # Users with reminders enabled, each with all the matches they still have to predict
+    reminder_targets = await get_reminder_targets(list(matches))
+
+    # Skip everything that was already sent before a restart
+    ledger = await get_reminder_ledger(list(matches))
+    digests = {}
+    match_users = defaultdict(list)
+    for user_id, match_ids in reminder_targets.items():
+        new_match_ids = [match_id for match_id in match_ids if user_id not in ledger[match_id]]
+        dispatch_stats['already_sent'] += len(match_ids) - len(new_match_ids)
+        if new_match_ids:
+            digests[user_id] = format_digest([matches[match_id] for match_id in new_match_ids])
+            for match_id in new_match_ids:
+                match_users[match_id].append(user_id)
+    if not digests:
+        return
+
+    # Record before sending, so a crash halfway never sends the same reminder twice
+    await record_reminders(match_users)
+    await dispatch_reminders(bot, digests)
+    print(f"Sent {dispatch_stats['sent']} reminders in total, {len(digests)} in this run ({dispatch_stats['last_run_per_second']:.1f}/s)")
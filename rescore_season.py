@@ -0,0 +1,88 @@
+# rescore_season.py
+# Recomputes every prediction and user total of the season under a scoring rule set,
+# for audits and rule changes.
+# A running bot notices the rebuilt leaderboard before its next settlement and reloads it;
+# /leaderboard shows the old ranking until then, or until the bot is restarted.
+#
+# Usage: python rescore_season.py [--rule-set NAME] [--apply]
+
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from storage import STORAGE_BACKEND, backend, init_storage
+from scoring import RULE_SETS, ACTIVE_RULE_SET, get_rule_set, score_predictions
+from snapshot import discard_snapshot
+from football_api import get_fixture_index, close_session
+
+async def load_fixture_stages():
+    try:
+        index = await get_fixture_index()
+    finally:
+        await close_session()
+    return {match.id: match.stage for match in index.matches}
+
+def fill_missing_stages(season_predictions, rule_set):
+    # Games settled before the stage was stored take it from the fixture feed, otherwise
+    # stage multipliers would silently count them once
+    if not get_rule_set(rule_set)['stage_multipliers']:
+        return season_predictions
+    missing = {pred['match_id'] for _, pred, game in season_predictions if not game.get('stage')}
+    if not missing:
+        return season_predictions
+    stages = asyncio.run(load_fixture_stages())
+    unknown = missing - set(stages)
+    if unknown:
+        print(f"No stage found in the fixture feed for matches {', '.join(sorted(unknown))}, they count once")
+    return [
+        (prediction_id, pred, game if game.get('stage') else dict(game, stage=stages.get(pred['match_id'])))
+        for prediction_id, pred, game in season_predictions
+    ]
+
+def rescore(season_predictions, rule_set):
+    points = score_predictions(
+        [game['home_score'] for _, _, game in season_predictions],
+        [game['away_score'] for _, _, game in season_predictions],
+        [pred['home_goals'] for _, pred, _ in season_predictions],
+        [pred['away_goals'] for _, pred, _ in season_predictions],
+        stages=[game.get('stage') for _, _, game in season_predictions],
+        rule_set=rule_set
+    ).tolist()
+
+    prediction_points = {}
+    user_totals = defaultdict(int)
+    for (prediction_id, pred, _), prediction_points_value in zip(season_predictions, points):
+        prediction_points[prediction_id] = prediction_points_value
+        user_totals[pred['user_id']] += prediction_points_value
+    return prediction_points, user_totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score the whole season under a rule set.")
+    parser.add_argument('--rule-set', default=ACTIVE_RULE_SET, choices=sorted(RULE_SETS))
+    parser.add_argument('--apply', action='store_true', help="write the new points instead of only reporting them")
+    args = parser.parse_args()
+
+    init_storage()
+    start = time.perf_counter()
+    season_predictions = fill_missing_stages(backend.get_season_predictions(), args.rule_set)
+    prediction_points, user_totals = rescore(season_predictions, args.rule_set)
+    print(f"Re-scored {len(prediction_points)} {STORAGE_BACKEND} predictions under '{args.rule_set}' in {time.perf_counter() - start:.2f} s")
+
+    # Report the users whose total would change
+    current_totals = backend.get_leaderboard()
+    for user_id in sorted(set(current_totals) | set(user_totals), key=lambda user_id: -user_totals.get(user_id, 0)):
+        old_points = current_totals.get(user_id, 0)
+        new_points = user_totals.get(user_id, 0)
+        if old_points != new_points:
+            print(f"  user {user_id}: {old_points} -> {new_points}")
+
+    if args.apply:
+        backend.apply_rescore(prediction_points, user_totals)
+        # The bot's local leaderboard snapshot no longer matches the stored points
+        discard_snapshot()
+        print("New points applied.")
+    else:
+        print("Dry run, nothing was written. Use --apply to write the new points.")
+
+if __name__ == '__main__':
+    main()
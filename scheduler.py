@@ -0,0 +1,159 @@
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+import pytz
+import football_api
+import game_updates
+from football_api import get_fixture_index
+from game_updates import check_game_updates, load_settled_matches, NOT_PLAYED_STATUSES
+from reminders import send_prediction_reminders
+from async_db import run_blocking, get_leaderboard_state
+from snapshot import load_snapshot, save_snapshot
+from storage import backend
+from startup import startup_step
+
+# Reminders go out 24 hours before the first kickoff of a (Belgian) day, for all of that
+# day's matches at once, or up to an hour later after a restart
+REMINDER_BEFORE = timedelta(hours=24)
+REMINDER_GRACE = timedelta(hours=1)
+# Full time is expected around 110 minutes after kickoff, then we retry until the match is FINISHED
+EXPECTED_DURATION = timedelta(minutes=110)
+RESULT_RETRY = timedelta(minutes=5)
+# A match that is still not FINISHED this long after kickoff is no longer polled for; it is
+# settled by the next result check of another match once the feed reports it FINISHED
+RESULT_RETRY_LIMIT = timedelta(hours=24)
+# Even between matchdays the fixture list is re-checked for schedule changes
+MAX_SLEEP = timedelta(hours=6)
+ERROR_RETRY = timedelta(minutes=1)
+
+# Fixed loops this scheduler replaces: results every 5 minutes and reminders every hour,
+# each tick fetching the feed once
+FIXED_RESULT_CHECKS_PER_DAY = 24 * 12
+FIXED_LOOP_TICKS_PER_DAY = FIXED_RESULT_CHECKS_PER_DAY + 24
+
+planned_timeline = []
+reminded_match_ids = set()
+last_result_check = datetime.min.replace(tzinfo=pytz.utc)
+# Set after every wakeup that fetched the fixtures and ran its due work without errors
+last_successful_poll = None
+scheduler_task = None
+
+def plan_timeline(index, settled_ids, now):
+    # Build a sorted list of (when, kind, match) events from the fixture index
+    timeline = []
+    # The matches of one day share their reminder, so users get one digest per evening
+    first_kickoffs = {}
+    for match in index.matches:
+        if match.is_scheduled:
+            first_kickoffs.setdefault(match.local_kickoff.date(), match.kickoff)
+    for match in index.matches:
+        if match.id in settled_ids or match.status in NOT_PLAYED_STATUSES:
+            continue
+
+        reminder_at = first_kickoffs.get(match.local_kickoff.date(), match.kickoff) - REMINDER_BEFORE
+        if match.is_scheduled and match.id not in reminded_match_ids and now < reminder_at + REMINDER_GRACE:
+            timeline.append((max(reminder_at, now), 'reminder', match))
+
+        result_at = match.kickoff + EXPECTED_DURATION
+        if result_at <= now:
+            if now > match.kickoff + RESULT_RETRY_LIMIT:
+                continue
+            # Overdue result: keep retrying at a short interval until it is settled
+            result_at = max(now, last_result_check + RESULT_RETRY)
+        timeline.append((result_at, 'result', match))
+
+    timeline.sort(key=lambda event: event[0])
+    return timeline
+
+def describe_timeline(timeline, now):
+    # Summarize the wakeups, result checks and feed requests per day, next to what the fixed
+    # loops would cost. Every wakeup may refresh the fixture list and every result check also
+    # asks for the finished matches; retries of late results add one of each per 5 minutes
+    wakeups = sorted({when for when, _, _ in timeline})
+    per_day = Counter(when.date() for when in wakeups)
+    checks_per_day = Counter(when.date() for when in {when for when, kind, _ in timeline if kind == 'result'})
+    message = f"Scheduler: {len(wakeups)} planned wakeups"
+    if wakeups:
+        message += f", next at {wakeups[0].strftime('%Y-%m-%d %H:%M')} UTC ({wakeups[0] - now} from now)"
+    for day, count in sorted(per_day.items()):
+        checks = checks_per_day[day]
+        message += (f"\n  {day}: {count} wakeups, {checks} result checks, up to {count + checks} feed requests "
+                    f"(fixed loops: {FIXED_LOOP_TICKS_PER_DAY} wakeups, {FIXED_RESULT_CHECKS_PER_DAY} result checks, "
+                    f"{FIXED_LOOP_TICKS_PER_DAY} feed requests)")
+    return message
+
+def restore_snapshot():
+    # Called once at startup: the fixtures, the settled watermark and the leaderboard come
+    # from the local snapshot, and the first poll only asks the feed what changed since
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return
+    fixtures = snapshot['fixtures']
+    if fixtures:
+        age = fixtures['age'] + max(time.time() - snapshot['saved_at'], 0)
+        football_api.feed_cache[()] = {'matches': fixtures['matches'], 'etag': fixtures['etag'], 'fetched_at': time.monotonic() - age}
+    game_updates.settled_matches = dict(snapshot['settled'])
+    backend.restore_leaderboard(snapshot['leaderboard'], snapshot.get('leaderboard_generation'))
+
+async def save_state_snapshot():
+    if game_updates.settled_matches is None:
+        return
+    try:
+        generation, ranking = await get_leaderboard_state()
+        await run_blocking(save_snapshot, football_api.feed_cache.get(()), game_updates.settled_matches, ranking, generation)
+    except OSError as e:
+        print(f"Could not write the snapshot: {e}")
+
+async def run_scheduler(bot):
+    global planned_timeline, last_result_check, last_successful_poll
+    previous_wakeups = None
+    # Results and the leaderboard are posted to a channel, which needs the guild cache
+    await bot.wait_until_ready()
+    with startup_step('first_feed_load'):
+        try:
+            await get_fixture_index()
+        except Exception as e:
+            print(f"An error occurred while loading the fixtures: {e}")
+    while True:
+        now = datetime.utcnow().replace(tzinfo=pytz.utc)
+        try:
+            # Recomputed from the (cached) fixtures on every wakeup, so restarts need no extra state
+            index = await get_fixture_index()
+            planned_timeline = plan_timeline(index, await load_settled_matches(), now)
+            wakeups = [when for when, _, _ in planned_timeline]
+            if wakeups != previous_wakeups:
+                print(describe_timeline(planned_timeline, now))
+                previous_wakeups = wakeups
+
+            due = [(kind, match) for when, kind, match in planned_timeline if when <= now]
+            reminder_matches = [match for kind, match in due if kind == 'reminder']
+            if reminder_matches:
+                # Every other match that is not reminded yet and starts within a day goes in the
+                # same digest, instead of a second DM at its own reminder time
+                upcoming = [match for match in index.kicked_off_between(now, now + REMINDER_BEFORE)
+                            if match.is_scheduled and match.id not in reminded_match_ids]
+                reminder_matches = list({match.id: match for match in reminder_matches + upcoming}.values())
+                await send_prediction_reminders(bot, reminder_matches)
+                # Only after a successful run, a failed one is retried on the next wakeup and
+                # the reminder ledger skips whoever was already sent a digest
+                reminded_match_ids.update(match.id for match in reminder_matches)
+            if any(kind == 'result' for kind, _ in due):
+                last_result_check = now
+                await check_game_updates(bot)
+            last_successful_poll = now
+            await save_state_snapshot()
+            if due:
+                continue
+
+            next_wakeup = wakeups[0] if wakeups else now + MAX_SLEEP
+            sleep_for = min(next_wakeup - now, MAX_SLEEP)
+        except Exception as e:
+            print(f"An error occurred in the scheduler: {e}")
+            sleep_for = ERROR_RETRY
+        await asyncio.sleep(max(sleep_for.total_seconds(), 1))
+
+def start_scheduler(bot):
+    global scheduler_task
+    if scheduler_task is None:
+        scheduler_task = asyncio.get_running_loop().create_task(run_scheduler(bot))
@@ -0,0 +1,68 @@
+import json
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Point values per rule set. Extra rule sets can be added in the JSON file named by
+# SCORING_RULES_FILE, e.g. {"cup": {"exact": 12, "stage_multipliers": {"FINAL": 3}}}
+DEFAULT_RULES = {
+    'exact': 10,
+    'goal_difference': 7,
+    'outcome': 5,
+    'participation': 1,
+    # Multiplier per football-data.org stage, stages that are not listed count once
+    'stage_multipliers': {}
+}
+RULE_SETS = {
+    'default': DEFAULT_RULES,
+    'knockout_bonus': dict(DEFAULT_RULES, stage_multipliers={
+        'LAST_16': 1.5,
+        'QUARTER_FINALS': 1.5,
+        'SEMI_FINALS': 2,
+        'FINAL': 2
+    })
+}
+
+def load_rule_sets():
+    rules_file = os.getenv('SCORING_RULES_FILE')
+    if rules_file and os.path.exists(rules_file):
+        with open(rules_file) as f:
+            for name, rules in json.load(f).items():
+                RULE_SETS[name] = dict(DEFAULT_RULES, **rules)
+
+load_rule_sets()
+ACTIVE_RULE_SET = os.getenv('SCORING_RULE_SET', 'default')
+# Fail at startup rather than on every settlement
+if ACTIVE_RULE_SET not in RULE_SETS:
+    raise ValueError(f"Unknown scoring rule set: {ACTIVE_RULE_SET} (available: {', '.join(sorted(RULE_SETS))})")
+
+def get_rule_set(name=None):
+    return RULE_SETS[name or ACTIVE_RULE_SET]
+
+def score_predictions(actual_home, actual_away, predicted_home, predicted_away, stages=None, rule_set=None):
+    # Score whole columns of predictions at once; every argument is an array of the same length
+    rules = get_rule_set(rule_set)
+    actual_home = np.asarray(actual_home, dtype=np.int64)
+    actual_away = np.asarray(actual_away, dtype=np.int64)
+    predicted_home = np.asarray(predicted_home, dtype=np.int64)
+    predicted_away = np.asarray(predicted_away, dtype=np.int64)
+
+    actual_difference = actual_home - actual_away
+    predicted_difference = predicted_home - predicted_away
+    points = np.select(
+        [
+            (actual_home == predicted_home) & (actual_away == predicted_away),
+            actual_difference == predicted_difference,
+            np.sign(actual_difference) == np.sign(predicted_difference)
+        ],
+        [rules['exact'], rules['goal_difference'], rules['outcome']],
+        default=rules['participation']
+    ).astype(np.float64)
+
+    if stages is not None and rules['stage_multipliers']:
+        points *= np.array([rules['stage_multipliers'].get(stage, 1) for stage in stages], dtype=np.float64)
+    # Halves round up, np.rint would round them to even (10.5 -> 10 but 7.5 -> 8)
+    return np.floor(points + 0.5).astype(np.int64)
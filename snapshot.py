@@ -0,0 +1,76 @@
+# snapshot.py
+# Local copy of the last fixture feed, the settled match IDs and the leaderboard, so a
+# restart can serve /predict and /leaderboard before the feed or the database answer.
+
+import json
+import os
+import tempfile
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'ucl_snapshot.json')
+SNAPSHOT_VERSION = 1
+
+# What was last written, to skip writes when nothing changed
+last_saved = None
+
+def write_atomically(path, data):
+    # Write to a temporary file next to the snapshot and rename it over the old one, so a
+    # crash never leaves a half-written snapshot behind
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def save_snapshot(fixtures, settled, ranking, generation=None):
+    # fixtures is the feed cache entry of the season fixture list, settled the settled
+    # watermark {match_id: lastUpdated}, ranking a list of (user_id, points) and generation
+    # the token of the stored leaderboard the ranking was read from
+    global last_saved
+    state = (fixtures and fixtures['matches'], dict(settled), [tuple(entry) for entry in ranking], generation)
+    if last_saved is not None and state[0] is last_saved[0] and state[1:] == last_saved[1:]:
+        return False
+
+    write_atomically(SNAPSHOT_PATH, {
+        'version': SNAPSHOT_VERSION,
+        'saved_at': time.time(),
+        'fixtures': fixtures and {
+            'matches': fixtures['matches'],
+            'etag': fixtures['etag'],
+            'age': time.monotonic() - fixtures['fetched_at']
+        },
+        'settled': state[1],
+        'leaderboard': state[2],
+        'leaderboard_generation': generation
+    })
+    last_saved = state
+    return True
+
+def load_snapshot():
+    # Returns the snapshot as written by save_snapshot, or None when there is no usable one
+    try:
+        with open(SNAPSHOT_PATH) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable snapshot {SNAPSHOT_PATH}: {e}")
+        return None
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+def discard_snapshot():
+    # Called by scripts that change points or games behind the bot's back
+    try:
+        os.remove(SNAPSHOT_PATH)
+    except FileNotFoundError:
+        pass
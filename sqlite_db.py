@@ -0,0 +1,402 @@
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+import pytz
+from dotenv import load_dotenv
+from db_utils import prediction_doc_id, group_past_predictions, collapse_predictions, set_kickoffs, check_kickoffs
+
+# Load environment variables from .env file
+load_dotenv()
+
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'ucl_prediction.db')
+
+# SQLite caps the number of bound parameters in one statement
+IN_QUERY_LIMIT = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    points INTEGER NOT NULL DEFAULT 0,
+    reminders INTEGER NOT NULL DEFAULT 1,
+    display_name TEXT
+);
+CREATE INDEX IF NOT EXISTS users_points ON users (points DESC);
+CREATE INDEX IF NOT EXISTS users_reminders ON users (reminders);
+
+CREATE TABLE IF NOT EXISTS predictions (
+    prediction_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    match_id TEXT NOT NULL,
+    home_goals INTEGER NOT NULL,
+    away_goals INTEGER NOT NULL,
+    points INTEGER NOT NULL DEFAULT 1,
+    settled INTEGER NOT NULL DEFAULT 0,
+    date TEXT,
+    home_team TEXT,
+    away_team TEXT,
+    home_score INTEGER,
+    away_score INTEGER,
+    stage TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS predictions_match_user ON predictions (match_id, user_id);
+CREATE INDEX IF NOT EXISTS predictions_user_date ON predictions (user_id, date);
+
+CREATE TABLE IF NOT EXISTS games (
+    match_id TEXT PRIMARY KEY,
+    home_score INTEGER,
+    away_score INTEGER,
+    status TEXT,
+    date TEXT,
+    home_team TEXT,
+    away_team TEXT,
+    stage TEXT
+);
+
+CREATE TABLE IF NOT EXISTS reminder_ledger (
+    match_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (match_id, user_id)
+);
+"""
+
+PREDICTION_COLUMNS = ['user_id', 'match_id', 'home_goals', 'away_goals', 'points', 'settled',
+                      'date', 'home_team', 'away_team', 'home_score', 'away_score', 'stage']
+GAME_COLUMNS = ['home_score', 'away_score', 'status', 'date', 'home_team', 'away_team', 'stage']
+
+# Every worker thread of async_db gets its own connection, WAL lets readers run next to the writer
+local = threading.local()
+
+def get_conn():
+    conn = getattr(local, 'conn', None)
+    if conn is None:
+        # Parameterized statements are prepared once and reused from the statement cache
+        conn = sqlite3.connect(SQLITE_PATH, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        local.conn = conn
+    return conn
+
+def init_sqlite():
+    conn = get_conn()
+    conn.executescript(SCHEMA)
+    conn.commit()
+
+def chunks(values, size=IN_QUERY_LIMIT):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def placeholders(values):
+    return ','.join('?' * len(values))
+
+def prediction_to_dict(row):
+    prediction = {column: row[column] for column in PREDICTION_COLUMNS if row[column] is not None}
+    prediction['settled'] = bool(row['settled'])
+    return prediction
+
+def save_prediction(user_id, match_id, home_goals, away_goals):
+    check_kickoffs([match_id])
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            "INSERT INTO predictions (prediction_id, user_id, match_id, home_goals, away_goals, points) VALUES (?, ?, ?, ?, ?, 1) "
+            "ON CONFLICT (prediction_id) DO UPDATE SET home_goals = excluded.home_goals, away_goals = excluded.away_goals, points = 1",
+            (prediction_doc_id(match_id, user_id), user_id, match_id, home_goals, away_goals)
+        )
+
+def save_predictions(user_id, predictions):
+    # predictions is {match_id: (home_goals, away_goals)}, written in one transaction
+    check_kickoffs(list(predictions))
+    conn = get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT INTO predictions (prediction_id, user_id, match_id, home_goals, away_goals, points) VALUES (?, ?, ?, ?, ?, 1) "
+            "ON CONFLICT (prediction_id) DO UPDATE SET home_goals = excluded.home_goals, away_goals = excluded.away_goals, points = 1",
+            [(prediction_doc_id(match_id, user_id), user_id, match_id, home_goals, away_goals) for match_id, (home_goals, away_goals) in predictions.items()]
+        )
+
+def get_leaderboard():
+    return dict(get_top_users())
+
+def get_top_users(n=None):
+    if n is None:
+        rows = get_conn().execute("SELECT user_id, points FROM users ORDER BY points DESC")
+    else:
+        rows = get_conn().execute("SELECT user_id, points FROM users ORDER BY points DESC LIMIT ?", (n,))
+    return [(row['user_id'], row['points']) for row in rows]
+
+def get_user_rank(user_id):
+    # Returns (rank, points) with rank starting at 1, or None for unknown users
+    conn = get_conn()
+    row = conn.execute("SELECT points FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None:
+        return None
+    higher = conn.execute("SELECT COUNT(*) FROM users WHERE points > ?", (row['points'],)).fetchone()[0]
+    return higher + 1, row['points']
+
+def get_predictions_match(match_id):
+    rows = get_conn().execute("SELECT * FROM predictions WHERE match_id = ?", (match_id,))
+    return {row['prediction_id']: prediction_to_dict(row) for row in rows}
+
+def get_predictions_user_match(user_id, match_id):
+    row = get_conn().execute("SELECT * FROM predictions WHERE prediction_id = ?", (prediction_doc_id(match_id, user_id),)).fetchone()
+    return prediction_to_dict(row) if row else None
+
+def get_predictions_user_matches(user_id, match_ids):
+    predictions = {match_id: None for match_id in match_ids}
+    for chunk in chunks(match_ids):
+        rows = get_conn().execute(
+            f"SELECT * FROM predictions WHERE user_id = ? AND match_id IN ({placeholders(chunk)})", (user_id, *chunk)
+        )
+        for row in rows:
+            predictions[row['match_id']] = prediction_to_dict(row)
+    return predictions
+
+def update_prediction_points(prediction_id, points):
+    conn = get_conn()
+    with conn:
+        conn.execute("UPDATE predictions SET points = ? WHERE prediction_id = ?", (points, prediction_id))
+
+def update_game_result(match_id, home_score, away_score, match_date, home_team, away_team):
+    conn = get_conn()
+    row = conn.execute("SELECT status FROM games WHERE match_id = ?", (match_id,)).fetchone()
+    if row and row['status'] == 'finished':
+        return True
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO games (match_id, home_score, away_score, status, date, home_team, away_team) VALUES (?, ?, ?, 'finished', ?, ?, ?)",
+            (match_id, home_score, away_score, match_date, home_team, away_team)
+        )
+    return False
+
+def add_user_points(conn, user_id, points):
+    conn.execute(
+        "INSERT INTO users (user_id, points, reminders) VALUES (?, ?, 1) "
+        "ON CONFLICT (user_id) DO UPDATE SET points = points + excluded.points",
+        (user_id, points)
+    )
+
+def update_user_points(user_id, points):
+    conn = get_conn()
+    with conn:
+        add_user_points(conn, user_id, points)
+
+def get_finished_game_ids(match_ids):
+    finished_ids = set()
+    for chunk in chunks(match_ids):
+        rows = get_conn().execute(
+            f"SELECT match_id FROM games WHERE status = 'finished' AND match_id IN ({placeholders(chunk)})", chunk
+        )
+        finished_ids.update(row['match_id'] for row in rows)
+    return finished_ids
+
+def get_settled_game_ids():
+    return [row['match_id'] for row in get_conn().execute("SELECT match_id FROM games WHERE status = 'finished'")]
+
+def get_predictions_matches(match_ids):
+    predictions = {match_id: {} for match_id in match_ids}
+    for chunk in chunks(match_ids):
+        rows = get_conn().execute(f"SELECT * FROM predictions WHERE match_id IN ({placeholders(chunk)})", chunk)
+        for row in rows:
+            predictions[row['match_id']][row['prediction_id']] = prediction_to_dict(row)
+    return predictions
+
+def get_display_names(user_ids):
+    names = {}
+    for chunk in chunks(user_ids):
+        rows = get_conn().execute(
+            f"SELECT user_id, display_name FROM users WHERE display_name IS NOT NULL AND user_id IN ({placeholders(chunk)})", chunk
+        )
+        names.update((row['user_id'], row['display_name']) for row in rows)
+    return names
+
+def save_display_names(names):
+    conn = get_conn()
+    with conn:
+        conn.executemany("UPDATE users SET display_name = ? WHERE user_id = ?", [(name, user_id) for user_id, name in names.items()])
+
+def commit_settlement(settlements):
+    # settlements is a list of (match_id, game_data, [(prediction_id, user_id, points), ...])
+    # Everything is written in one transaction, so a crash leaves the matches unsettled
+    conn = get_conn()
+    with conn:
+        for match_id, game_data, predictions in settlements:
+            conn.executemany(
+                "UPDATE predictions SET points = ?, settled = 1, date = ?, home_team = ?, away_team = ?, home_score = ?, away_score = ?, stage = ? "
+                "WHERE prediction_id = ?",
+                [(points, game_data['date'], game_data['home_team'], game_data['away_team'], game_data['home_score'],
+                  game_data['away_score'], game_data.get('stage'), prediction_id) for prediction_id, _, points in predictions]
+            )
+            user_points = defaultdict(int)
+            for _, user_id, points in predictions:
+                user_points[user_id] += points
+            for user_id, points in user_points.items():
+                add_user_points(conn, user_id, points)
+            conn.execute(
+                "INSERT OR REPLACE INTO games (match_id, home_score, away_score, status, date, home_team, away_team, stage) "
+                "VALUES (?, ?, ?, 'finished', ?, ?, ?, ?)",
+                (match_id, game_data['home_score'], game_data['away_score'], game_data['date'],
+                 game_data['home_team'], game_data['away_team'], game_data.get('stage'))
+            )
+
+def get_season_predictions():
+    # All predictions of finished games, each paired with its game data
+    rows = get_conn().execute(
+        "SELECT p.*, g.home_score AS game_home_score, g.away_score AS game_away_score, g.stage AS game_stage "
+        "FROM predictions p JOIN games g ON g.match_id = p.match_id WHERE g.status = 'finished'"
+    )
+    return [
+        (row['prediction_id'], prediction_to_dict(row),
+         {'home_score': row['game_home_score'], 'away_score': row['game_away_score'], 'stage': row['game_stage']})
+        for row in rows
+    ]
+
+def apply_rescore(prediction_points, user_totals):
+    conn = get_conn()
+    with conn:
+        conn.executemany("UPDATE predictions SET points = ? WHERE prediction_id = ?",
+                         [(points, prediction_id) for prediction_id, points in prediction_points.items()])
+        conn.executemany("UPDATE users SET points = ? WHERE user_id = ?",
+                         [(points, user_id) for user_id, points in user_totals.items()])
+
+def get_past_predictions(user_id, begin_date, end_date):
+    # Turn the Belgian date range into UTC bounds so the (user_id, date) index does the filtering
+    belgian_tz = pytz.timezone('Europe/Brussels')
+    begin_utc = belgian_tz.localize(datetime.strptime(begin_date, "%d/%m/%Y")).astimezone(pytz.utc)
+    end_utc = belgian_tz.localize(datetime.strptime(end_date, "%d/%m/%Y") + timedelta(days=1)).astimezone(pytz.utc)
+
+    rows = get_conn().execute(
+        "SELECT * FROM predictions WHERE user_id = ? AND date >= ? AND date < ? AND settled = 1",
+        (user_id, begin_utc.strftime("%Y-%m-%dT%H:%M:%SZ"), end_utc.strftime("%Y-%m-%dT%H:%M:%SZ"))
+    )
+    history = [{
+        'date': row['date'],
+        'home_team': row['home_team'],
+        'away_team': row['away_team'],
+        'actual_home_goals': row['home_score'],
+        'actual_away_goals': row['away_score'],
+        'predicted_home_goals': row['home_goals'],
+        'predicted_away_goals': row['away_goals'],
+        'points': row['points']
+    } for row in rows]
+    return group_past_predictions(history, begin_date, end_date)
+
+def get_users_without_predictions(match_id):
+    rows = get_conn().execute(
+        "SELECT user_id FROM users WHERE user_id NOT IN (SELECT user_id FROM predictions WHERE match_id = ?)", (match_id,)
+    )
+    return [row['user_id'] for row in rows]
+
+def get_reminder_targets(match_ids):
+    # Returns {user_id: [match_id, ...]} with every match a reminder-enabled user has not predicted
+    targets = defaultdict(list)
+    for match_id in match_ids:
+        rows = get_conn().execute(
+            "SELECT user_id FROM users WHERE reminders = 1 "
+            "AND user_id NOT IN (SELECT user_id FROM predictions WHERE match_id = ?)", (match_id,)
+        )
+        for row in rows:
+            targets[row['user_id']].append(match_id)
+    return dict(targets)
+
+def get_reminder_ledger(match_ids):
+    ledger = {match_id: set() for match_id in match_ids}
+    for chunk in chunks(match_ids):
+        rows = get_conn().execute(f"SELECT match_id, user_id FROM reminder_ledger WHERE match_id IN ({placeholders(chunk)})", chunk)
+        for row in rows:
+            ledger[row['match_id']].add(row['user_id'])
+    return ledger
+
+def record_reminders(match_users):
+    conn = get_conn()
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO reminder_ledger (match_id, user_id) VALUES (?, ?)",
+                         [(match_id, user_id) for match_id, user_ids in match_users.items() for user_id in user_ids])
+
+def get_all_registered_users():
+    return [row['user_id'] for row in get_conn().execute("SELECT user_id FROM users")]
+
+def get_users_with_prediction_for_match(match_id):
+    return [row['user_id'] for row in get_conn().execute("SELECT user_id FROM predictions WHERE match_id = ?", (match_id,))]
+
+def set_reminder(user_id, reminders):
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            "INSERT INTO users (user_id, points, reminders) VALUES (?, 0, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET reminders = excluded.reminders",
+            (user_id, int(reminders))
+        )
+
+def enable_reminder(user_id):
+    set_reminder(user_id, True)
+
+def disable_reminder(user_id):
+    set_reminder(user_id, False)
+
+def check_reminder_messages(user_id):
+    row = get_conn().execute("SELECT reminders FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    return bool(row and row['reminders'])
+
+def get_leaderboard_state():
+    # Returns (generation, ranking); the local database has no stored leaderboard to match
+    return None, get_top_users()
+
+def restore_leaderboard(ranking, generation):
+    # The ranking is always read from the local database
+    pass
+
+def flush_user_writes():
+    # User changes are written immediately, there is nothing to flush
+    pass
+
+def export_data():
+    conn = get_conn()
+    users = [dict(row) for row in conn.execute("SELECT * FROM users")]
+    for user in users:
+        user['reminders'] = bool(user['reminders'])
+    predictions = [dict(prediction_to_dict(row), prediction_id=row['prediction_id']) for row in conn.execute("SELECT * FROM predictions")]
+    games = [dict(row) for row in conn.execute("SELECT * FROM games")]
+    ledger = defaultdict(list)
+    for row in conn.execute("SELECT match_id, user_id FROM reminder_ledger"):
+        ledger[row['match_id']].append(row['user_id'])
+    reminder_ledger = [{'match_id': match_id, 'user_ids': user_ids} for match_id, user_ids in ledger.items()]
+    return {'users': users, 'predictions': predictions, 'games': games, 'reminder_ledger': reminder_ledger}
+
+def import_data(data):
+    # Firestore dumps from before the migration still have auto-ID predictions, possibly
+    # several per user and match; the upserts of save_prediction need the deterministic ID
+    finished_ids = {game['match_id'] for game in data['games'] if game.get('status') == 'finished'}
+    predictions, point_corrections = collapse_predictions(data['predictions'], finished_ids)
+    conn = get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO users (user_id, points, reminders, display_name) VALUES (?, ?, ?, ?)",
+            [(user['user_id'], user.get('points', 0) + point_corrections.get(user['user_id'], 0), int(user.get('reminders', False)),
+              user.get('display_name')) for user in data['users']]
+        )
+        conn.executemany(
+            f"INSERT OR REPLACE INTO predictions (prediction_id, {', '.join(PREDICTION_COLUMNS)}) VALUES (?, {placeholders(PREDICTION_COLUMNS)})",
+            [(prediction['prediction_id'], *(prediction.get(column) for column in PREDICTION_COLUMNS[:4]),
+              prediction.get('points', 1), int(prediction.get('settled', False)),
+              *(prediction.get(column) for column in PREDICTION_COLUMNS[6:])) for prediction in predictions]
+        )
+        conn.executemany(
+            f"INSERT OR REPLACE INTO games (match_id, {', '.join(GAME_COLUMNS)}) VALUES (?, {placeholders(GAME_COLUMNS)})",
+            [(game['match_id'], *(game.get(column) for column in GAME_COLUMNS)) for game in data['games']]
+        )
+        # Firestore predictions settled before the game data was copied onto them only have
+        # their points; the history query needs the game's date, teams and result on the row
+        conn.execute(
+            "UPDATE predictions SET settled = 1, date = g.date, home_team = g.home_team, away_team = g.away_team, "
+            "home_score = g.home_score, away_score = g.away_score, stage = COALESCE(predictions.stage, g.stage) "
+            "FROM games g WHERE g.match_id = predictions.match_id AND g.status = 'finished' AND predictions.date IS NULL"
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO reminder_ledger (match_id, user_id) VALUES (?, ?)",
+            [(entry['match_id'], user_id) for entry in data['reminder_ledger'] for user_id in entry['user_ids']]
+        )
@@ -0,0 +1,60 @@
+# startup.py
+# One-time startup work: syncing the slash commands only when they changed, and timing
+# each startup step so slow restarts show up on /metrics.
+
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from snapshot import write_atomically
+
+load_dotenv()
+COMMAND_HASH_PATH = os.getenv('COMMAND_HASH_PATH', 'ucl_command_tree.json')
+
+PROCESS_START = time.perf_counter()
+# step -> seconds, in the order the steps finished
+startup_timings = {}
+# Number of on_ready events, everything after the first one is a gateway reconnect
+ready_count = 0
+
+@contextmanager
+def startup_step(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        # Only the first run of a step counts as startup
+        startup_timings.setdefault(name, time.perf_counter() - start)
+
+def record_ready():
+    global ready_count
+    ready_count += 1
+    startup_timings.setdefault('gateway_ready', time.perf_counter() - PROCESS_START)
+    return ready_count
+
+def command_tree_hash(tree):
+    # The same payload tree.sync uploads, so any change Discord would see changes the hash
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda command: (command['name'], command.get('type', 1)))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def load_synced_hash(application_id):
+    try:
+        with open(COMMAND_HASH_PATH) as f:
+            synced = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return synced.get('hash') if synced.get('application_id') == application_id else None
+
+async def sync_commands(tree, application_id):
+    # Returns True when the commands were uploaded, False when Discord already has them
+    tree_hash = command_tree_hash(tree)
+    if load_synced_hash(application_id) == tree_hash:
+        return False
+    await tree.sync()
+    try:
+        write_atomically(COMMAND_HASH_PATH, {'application_id': application_id, 'hash': tree_hash})
+    except OSError as e:
+        print(f"Could not save the command tree hash: {e}")
+    return True
@@ -0,0 +1,71 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Select the storage backend with STORAGE_BACKEND=firestore (default) or STORAGE_BACKEND=sqlite
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'firestore')
+
+# The functions every storage backend provides, with the same arguments and return values
+STORAGE_FUNCTIONS = [
+    'save_prediction',
+    'save_predictions',
+    'set_kickoffs',
+    'get_leaderboard',
+    'get_top_users',
+    'get_leaderboard_state',
+    'get_user_rank',
+    'get_predictions_match',
+    'get_predictions_user_match',
+    'get_predictions_user_matches',
+    'update_prediction_points',
+    'update_game_result',
+    'update_user_points',
+    'get_finished_game_ids',
+    'get_settled_game_ids',
+    'get_predictions_matches',
+    'get_display_names',
+    'save_display_names',
+    'commit_settlement',
+    'get_season_predictions',
+    'apply_rescore',
+    'get_past_predictions',
+    'get_users_without_predictions',
+    'get_reminder_targets',
+    'get_reminder_ledger',
+    'record_reminders',
+    'get_all_registered_users',
+    'get_users_with_prediction_for_match',
+    'enable_reminder',
+    'disable_reminder',
+    'check_reminder_messages',
+    'flush_user_writes',
+    'restore_leaderboard',
+    'export_data',
+    'import_data'
+]
+
+def load_backend(name):
+    if name == 'firestore':
+        import firestore_db as backend
+    elif name == 'sqlite':
+        import sqlite_db as backend
+    else:
+        raise ValueError(f"Unknown storage backend: {name}")
+
+    missing = [function for function in STORAGE_FUNCTIONS if not hasattr(backend, function)]
+    if missing:
+        raise NotImplementedError(f"Storage backend {name} is missing: {', '.join(missing)}")
+    return backend
+
+def init_backend(backend):
+    if backend.__name__ == 'sqlite_db':
+        backend.init_sqlite()
+    else:
+        backend.init_firestore()
+
+backend = load_backend(STORAGE_BACKEND)
+
+def init_storage():
+    init_backend(backend)
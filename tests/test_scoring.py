@@ -0,0 +1,55 @@
+# Tests for the vectorized scoring of scoring.score_predictions
+
+import numpy as np
+import pytest
+from scoring import DEFAULT_RULES, RULE_SETS, score_predictions
+
+def score(actual, predicted, **kwargs):
+    return score_predictions([actual[0]], [actual[1]], [predicted[0]], [predicted[1]], **kwargs).tolist()[0]
+
+@pytest.mark.parametrize('actual, predicted, expected', [
+    ((2, 1), (2, 1), DEFAULT_RULES['exact']),
+    ((0, 0), (0, 0), DEFAULT_RULES['exact']),
+    ((2, 1), (1, 0), DEFAULT_RULES['goal_difference']),
+    ((1, 1), (2, 2), DEFAULT_RULES['goal_difference']),
+    ((3, 0), (1, 0), DEFAULT_RULES['outcome']),
+    ((0, 2), (1, 4), DEFAULT_RULES['outcome']),
+    ((2, 1), (0, 1), DEFAULT_RULES['participation']),
+    ((1, 1), (1, 0), DEFAULT_RULES['participation']),
+])
+def test_default_tiers(actual, predicted, expected):
+    assert score(actual, predicted) == expected
+
+def test_columns_are_scored_row_by_row():
+    points = score_predictions([2, 2, 2, 2], [1, 1, 1, 1], [2, 3, 3, 0], [1, 2, 0, 3])
+    assert points.dtype == np.int64
+    assert points.tolist() == [10, 7, 5, 1]
+
+def test_empty_columns():
+    assert score_predictions([], [], [], []).tolist() == []
+
+def test_default_rules_ignore_stages():
+    assert score((2, 1), (2, 1), stages=['FINAL']) == 10
+
+@pytest.mark.parametrize('stage, expected', [
+    ('LEAGUE_STAGE', [10, 7, 5, 1]),
+    (None, [10, 7, 5, 1]),
+    ('SEMI_FINALS', [20, 14, 10, 2]),
+    ('FINAL', [20, 14, 10, 2]),
+    # 15, 10.5, 7.5 and 1.5: halves always round up
+    ('LAST_16', [15, 11, 8, 2]),
+    ('QUARTER_FINALS', [15, 11, 8, 2]),
+])
+def test_stage_multipliers(stage, expected):
+    points = score_predictions([2, 2, 2, 2], [1, 1, 1, 1], [2, 3, 3, 0], [1, 2, 0, 3], stages=[stage] * 4, rule_set='knockout_bonus')
+    assert points.tolist() == expected
+
+def test_multipliers_per_row():
+    points = score_predictions([1, 1, 1], [0, 0, 0], [1, 1, 1], [0, 0, 0], stages=['LEAGUE_STAGE', 'LAST_16', 'FINAL'], rule_set='knockout_bonus')
+    assert points.tolist() == [10, 15, 20]
+
+def test_half_up_rounding(monkeypatch):
+    monkeypatch.setitem(RULE_SETS, 'halves', dict(DEFAULT_RULES, stage_multipliers={'X': 0.5}))
+    # 5, 3.5, 2.5 and 0.5
+    points = score_predictions([2, 2, 2, 2], [1, 1, 1, 1], [2, 3, 3, 0], [1, 2, 0, 3], stages=['X'] * 4, rule_set='halves')
+    assert points.tolist() == [5, 4, 3, 1]
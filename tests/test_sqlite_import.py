@@ -0,0 +1,55 @@
+# Tests for importing a Firestore export into the SQLite backend
+
+import threading
+import pytest
+import sqlite_db
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite_db, 'SQLITE_PATH', str(tmp_path / 'ucl_prediction.db'))
+    monkeypatch.setattr(sqlite_db, 'local', threading.local())
+    sqlite_db.init_sqlite()
+    return sqlite_db
+
+def firestore_dump():
+    # Auto-ID predictions as written before migrate_predictions, with a duplicate that was
+    # settled twice and one prediction of a match that is not played yet
+    return {
+        'users': [{'user_id': '1', 'points': 20, 'reminders': True}, {'user_id': '2', 'points': 1, 'reminders': False}],
+        'predictions': [
+            {'prediction_id': 'Xa81kq', 'user_id': '1', 'match_id': '500', 'home_goals': 2, 'away_goals': 1, 'points': 10},
+            {'prediction_id': 'P0c3zz', 'user_id': '1', 'match_id': '500', 'home_goals': 2, 'away_goals': 1, 'points': 10},
+            {'prediction_id': 'f9Qm2w', 'user_id': '2', 'match_id': '500', 'home_goals': 0, 'away_goals': 3, 'points': 1},
+            {'prediction_id': 'Lr7Tt0', 'user_id': '1', 'match_id': '501', 'home_goals': 1, 'away_goals': 1, 'points': 1},
+        ],
+        'games': [{'match_id': '500', 'home_score': 2, 'away_score': 1, 'status': 'finished',
+                   'date': '2024-10-01T19:00:00Z', 'home_team': 'Club Brugge', 'away_team': 'AC Milan'}],
+        'reminder_ledger': []
+    }
+
+def test_import_rekeys_predictions(db):
+    db.import_data(firestore_dump())
+    prediction = db.get_predictions_user_match('1', '501')
+    assert prediction['home_goals'] == 1 and prediction['away_goals'] == 1
+    assert set(db.get_predictions_match('500')) == {'500_1', '500_2'}
+
+def test_import_takes_back_points_of_duplicates(db):
+    db.import_data(firestore_dump())
+    assert db.get_leaderboard() == {'1': 10, '2': 1}
+
+def test_save_after_import(db):
+    db.import_data(firestore_dump())
+    db.save_prediction('1', '501', 3, 0)
+    db.save_predictions('2', {'501': (0, 0), '502': (1, 2)})
+    assert db.get_predictions_user_match('1', '501')['home_goals'] == 3
+    assert db.get_predictions_user_matches('2', ['501', '502']) == {
+        '501': {'user_id': '2', 'match_id': '501', 'home_goals': 0, 'away_goals': 0, 'points': 1, 'settled': False},
+        '502': {'user_id': '2', 'match_id': '502', 'home_goals': 1, 'away_goals': 2, 'points': 1, 'settled': False}
+    }
+
+def test_round_trip_keeps_the_history(db):
+    db.import_data(firestore_dump())
+    history = db.get_past_predictions('1', '01/10/2024', '01/10/2024')
+    assert [game['points'] for game in history['01/10/2024']['21:00']] == [10]
+    db.import_data(db.export_data())
+    assert db.get_past_predictions('1', '01/10/2024', '01/10/2024') == history
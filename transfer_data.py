@@ -0,0 +1,36 @@
+# transfer_data.py
+# Moves all game data between storage backends through a JSON file.
+#
+# Usage: python transfer_data.py export firestore dump.json
+#        python transfer_data.py import sqlite dump.json
+
+import argparse
+import json
+from storage import load_backend, init_backend
+from snapshot import discard_snapshot
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import all data of a storage backend.")
+    parser.add_argument('action', choices=['export', 'import'])
+    parser.add_argument('backend', choices=['firestore', 'sqlite'])
+    parser.add_argument('file')
+    args = parser.parse_args()
+
+    backend = load_backend(args.backend)
+    init_backend(backend)
+
+    if args.action == 'export':
+        data = backend.export_data()
+        with open(args.file, 'w') as f:
+            json.dump(data, f)
+    else:
+        with open(args.file) as f:
+            data = json.load(f)
+        backend.import_data(data)
+        discard_snapshot()
+
+    counts = ', '.join(f"{len(rows)} {name}" for name, rows in data.items())
+    print(f"{args.action.capitalize()}ed {counts} ({args.backend})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from collections import OrderedDict
+from async_db import get_display_names, save_display_names
+
+# Display names are kept for a few hours in a bounded LRU cache
+NAME_CACHE_TTL = 6 * 3600
+NAME_CACHE_SIZE = 5000
+# Discord returns at most 100 members per gateway member request
+MEMBER_CHUNK_SIZE = 100
+FETCH_USER_CONCURRENCY = 5
+
+name_cache = OrderedDict()
+name_stats = {'cache': 0, 'gateway': 0, 'stored': 0, 'chunked': 0, 'fetched': 0}
+
+def get_cached_name(user_id):
+    entry = name_cache.get(user_id)
+    if entry is None:
+        return None
+    name, expires_at = entry
+    if expires_at < time.monotonic():
+        del name_cache[user_id]
+        return None
+    name_cache.move_to_end(user_id)
+    return name
+
+def cache_name(user_id, name):
+    name_cache[user_id] = (name, time.monotonic() + NAME_CACHE_TTL)
+    name_cache.move_to_end(user_id)
+    while len(name_cache) > NAME_CACHE_SIZE:
+        name_cache.popitem(last=False)
+
+def get_gateway_name(bot, user_id):
+    # Members and users the gateway already sent us cost no API call
+    for guild in bot.guilds:
+        member = guild.get_member(int(user_id))
+        if member is not None:
+            return member.display_name
+    user = bot.get_user(int(user_id))
+    return user.display_name if user else None
+
+async def query_guild_names(bot, user_ids):
+    names = {}
+    for guild in bot.guilds:
+        missing = [user_id for user_id in user_ids if user_id not in names]
+        for i in range(0, len(missing), MEMBER_CHUNK_SIZE):
+            chunk = [int(user_id) for user_id in missing[i:i + MEMBER_CHUNK_SIZE]]
+            try:
+                members = await guild.query_members(user_ids=chunk, limit=MEMBER_CHUNK_SIZE)
+            except asyncio.TimeoutError:
+                continue
+            for member in members:
+                names[str(member.id)] = member.display_name
+    return names
+
+async def fetch_user_names(bot, user_ids):
+    semaphore = asyncio.Semaphore(FETCH_USER_CONCURRENCY)
+
+    async def fetch_name(user_id):
+        async with semaphore:
+            user = await bot.fetch_user(int(user_id))
+            return user_id, user.display_name
+
+    return dict(await asyncio.gather(*(fetch_name(user_id) for user_id in user_ids)))
+
+async def resolve_display_names(bot, user_ids):
+    names = {}
+    missing = []
+    for user_id in user_ids:
+        name = get_cached_name(user_id)
+        if name is not None:
+            name_stats['cache'] += 1
+        else:
+            name = get_gateway_name(bot, user_id)
+            if name is not None:
+                name_stats['gateway'] += 1
+        if name is None:
+            missing.append(user_id)
+        else:
+            names[user_id] = name
+
+    # Names stored with the users documents by an earlier render
+    if missing:
+        stored_names = await get_display_names(missing)
+        name_stats['stored'] += len(stored_names)
+        names.update(stored_names)
+        missing = [user_id for user_id in missing if user_id not in stored_names]
+
+    new_names = {}
+    if missing:
+        new_names = await query_guild_names(bot, missing)
+        name_stats['chunked'] += len(new_names)
+        missing = [user_id for user_id in missing if user_id not in new_names]
+    if missing:
+        fetched_names = await fetch_user_names(bot, missing)
+        name_stats['fetched'] += len(fetched_names)
+        new_names.update(fetched_names)
+    if new_names:
+        names.update(new_names)
+        await save_display_names(new_names)
+
+    for user_id, name in names.items():
+        cache_name(user_id, name)
+    return names
+
+async def get_discord_user(bot, user_id):
+    # Prefer the gateway cache before asking the REST API
+    user = bot.get_user(int(user_id))
+    if user is None:
+        user = await bot.fetch_user(int(user_id))
+    return user